@@ -1,23 +1,78 @@
 ## Counts the number of variants in each 1KGP superpopulation (EAS, AMR, AFR, EUR, SAS) across all VCF files in the specified folder. Also counts the number of variants unique to each superpopulation. Outputs results to text files and saves variants for each population to separate VCF files.
 
 import os
+import re
 import gzip
-import matplotlib.pyplot as plt
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from bgzf import BgzfReader, TabixVcfWriter, get_linear_index, window_offset
+
+# ---------- EDIT THESE ----------
+MODE = 'scan'            # 'scan' = every record of every file, 'regions' = only the records at the GWAS_BED positions
+GWAS_BED = '/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/NHGRI_EBI_GWAS/all_gwas.bed'  # sorted BED for MODE = 'regions'
+FOLDER_PATH = '/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/1KGP_hg38/'
+N_WORKERS = 1            # >1 scans each chromosome file in its own process and merges the results
+SHARD_DIR = 'variant_shards'  # per-file population outputs written by the workers before merging
+PARSER = 'blocks'        # 'blocks' = Arrow record batches with vectorised INFO parsing, 'lines' = original per-record loop
+BLOCK_SIZE = 64 << 20    # bytes of VCF text per record batch for the 'blocks' parser
+OUTPUT_FORMAT = 'text'   # 'text' = plain {pop}_variants.vcf (chr, start, end, rsID, REF, ALT, AF), 'vcf.gz' = sorted bgzipped VCF + .tbi
+N_AF_BINS = 20           # AF histogram resolution: bin 0 holds AF == 0, bins 1..N_AF_BINS split (0, 1] evenly
+# -------------------------------
 
 # Initialize counters for each population
 populations = ['EAS', 'AMR', 'AFR', 'EUR', 'SAS']
 pop_count = {pop: 0 for pop in populations}
 unique_pop_count = {pop: 0 for pop in populations}
 
-# Initialise file for storing variants for each populations
-variant_files = {pop: open(f'{pop}_variants.vcf', 'w') for pop in populations}
+# Function to create empty AF histograms: one per population plus the joint EUR x EAS table.
+# All bins are fixed, so histograms from different files or workers merge by simple addition.
+def new_af_histograms():
+    return {
+        'pop': {pop: np.zeros(N_AF_BINS + 1, dtype=np.int64) for pop in populations},
+        'EUR_EAS': np.zeros((N_AF_BINS + 1, N_AF_BINS + 1), dtype=np.int64),
+    }
+
+af_hists = new_af_histograms()
+
+# Function to make the VCF header for a population's bgzipped output
+def vcf_header(pop):
+    return (
+        '##fileformat=VCFv4.2\n'
+        '##source=1KGP_population_variants.py\n'
+        f'##INFO=<ID=AF,Number=1,Type=Float,Description="{pop} allele frequency in 1KGP (max over ALT alleles)">\n'
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+    )
+
+# Function to open the files for storing variants for each population.
+# Shards (parallel mode) get no header and keep their tabix index in memory until they are merged.
+def open_variant_files(prefix='', output_format=OUTPUT_FORMAT, shard=False):
+    if output_format == 'vcf.gz':
+        variant_files = {pop: TabixVcfWriter(f'{prefix}{pop}_variants.vcf.gz', index_path=None if shard else '') for pop in populations}
+        if not shard:
+            for pop, file in variant_files.items():
+                file.write(vcf_header(pop))
+        return variant_files
+    return {pop: open(f'{prefix}{pop}_variants.vcf', 'w') for pop in populations}
+
+# Helper function to check which output format a set of population files uses
+def output_format_of(variant_files):
+    return 'vcf.gz' if isinstance(next(iter(variant_files.values())), TabixVcfWriter) else 'text'
 
 # Function to process a single file
-def process_file(filepath):
+def process_file(filepath, pop_count, unique_pop_count, variant_files, af_hists):
+    n_records = 0
+    vcf_output = output_format_of(variant_files) == 'vcf.gz'
     with gzip.open(filepath, 'rt') as f:
         for line in f:
             if line.startswith('#'):
                 continue
+            n_records += 1
 
             # Split the line by tabs and defined the desired columns
             cols = line.strip().split('\t')
@@ -46,16 +101,23 @@ def process_file(filepath):
                 'SAS': sas_af
             }
 
+            # Add the site to the AF histograms
+            update_af_histograms(af_hists, af_values)
+
             # Count each variant in the populations it appears in
             populations_present = [pop for pop, af in af_values.items() if af > 0]
             for pop in populations_present:
                 pop_count[pop] += 1 
                 # write variant information to the population-specific file
-                variant_files[pop].write(f"{chr}\t{start_pos}\t{end_pos}\t{rsid}\t{ra}\t{aa}\t{af_values[pop]}\n")
+                if vcf_output:
+                    variant_files[pop].write(f"{chr}\t{start_pos}\t{rsid}\t{ra}\t{aa}\t.\t.\tAF={af_values[pop]}\n")
+                else:
+                    variant_files[pop].write(f"{chr}\t{start_pos}\t{end_pos}\t{rsid}\t{ra}\t{aa}\t{af_values[pop]}\n")
 
             # Count variants found in only one population
             if len(populations_present) == 1:
                 unique_pop_count[populations_present[0]] += 1
+    return n_records
 
 # Helper function to extract allele frequency from the info field
 def extract_af(info_field, af_key):
@@ -68,14 +130,284 @@ def extract_af(info_field, af_key):
             return max(af_values)  # Use the max AF value
     return 0.0
 
+# Helper function to map AF values (a single float or an array) to histogram bins.
+# Bins are closed on the right; the rounding stops e.g. 0.15 * 20 = 3.0000000000000004 spilling into the next bin.
+def af_bin(af):
+    return np.clip(np.ceil(np.round(np.asarray(af) * N_AF_BINS, 9)), 0, N_AF_BINS).astype(np.int64)
+
+# Function to add one site's AF values to the histograms (used by the line loop)
+def update_af_histograms(af_hists, af_values):
+    for pop, af in af_values.items():
+        af_hists['pop'][pop][af_bin(af)] += 1
+    af_hists['EUR_EAS'][af_bin(af_values['EUR']), af_bin(af_values['EAS'])] += 1
+
+# Function to add a block of sites to the histograms; af is an (n_records, n_populations) array
+def update_af_histograms_block(af_hists, af):
+    bins = af_bin(af)
+    for j, pop in enumerate(populations):
+        af_hists['pop'][pop] += np.bincount(bins[:, j], minlength=N_AF_BINS + 1)
+    eur, eas = bins[:, populations.index('EUR')], bins[:, populations.index('EAS')]
+    joint = np.bincount(eur * (N_AF_BINS + 1) + eas, minlength=(N_AF_BINS + 1) ** 2)
+    af_hists['EUR_EAS'] += joint.reshape(N_AF_BINS + 1, N_AF_BINS + 1)
+
+# Function to add one set of histograms into another (reduce step for files and workers)
+def merge_af_histograms(af_hists, other):
+    for pop in populations:
+        af_hists['pop'][pop] += other['pop'][pop]
+    af_hists['EUR_EAS'] += other['EUR_EAS']
+
+# Function to count the '#' header lines at the top of a VCF so the block reader can skip them
+def count_header_lines(filepath):
+    n_header = 0
+    with gzip.open(filepath, 'rt') as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            n_header += 1
+    return n_header
+
+# Vectorised version of extract_af for an Arrow column of INFO strings: returns an (n_records, n_populations) array
+def extract_af_block(info):
+    af = np.zeros((len(info), len(populations)))
+    for j, pop in enumerate(populations):
+        # same match as extract_af: the INFO entry that starts with '{pop}_AF=' (null where the key is missing)
+        raw = pc.struct_field(pc.extract_regex(info, f'(?:^|;){pop}_AF=(?P<af>[^;]*)'), [0])
+
+        # multiallelic sites (e.g. '0.002,0.001') are split into one value per allele and reduced to the max AF
+        parts = pc.split_pattern(raw, ',')
+        values = pc.list_flatten(parts)
+        values = pc.if_else(pc.equal(values, '.'), pa.scalar(None, pa.string()), values)  # ignore missing values
+        values = pc.cast(values, pa.float64()).to_numpy(zero_copy_only=False)  # nulls become NaN
+        np.fmax.at(af[:, j], pc.list_parent_indices(parts).to_numpy(), values)  # fmax skips NaN, so no value -> 0.0
+    return af
+
+# Function to format an array of AF values as Arrow strings exactly like the f-string in process_file (str(float)).
+# Arrow's cast gives the same shortest round-trip text except for integral values ('1' vs '1.0') and values Python
+# writes with an exponent (below 1e-4, or very large), so only those few rows are formatted in Python.
+def format_af(af, prefix=''):
+    text = pc.cast(pa.array(af), pa.string())
+    odd = (af < 1e-4) | (af >= 1e15) | (af == np.floor(af))
+    if odd.any():
+        text = pc.replace_with_mask(text, pa.array(odd), pa.array([str(x) for x in af[odd]], pa.string()))
+    return pc.binary_join_element_wise(prefix, text, '') if prefix else text
+
+# Function to write a table of variants as tab-separated lines in the same layout as process_file
+def write_variant_block(variant_file, table):
+    buf = pa.BufferOutputStream()
+    pv.write_csv(table, buf, write_options=pv.WriteOptions(include_header=False, delimiter='\t', quoting_style='none'))
+    text = buf.getvalue().to_pybytes().decode()
+    if isinstance(variant_file, TabixVcfWriter):
+        # pass the coordinates along so the tabix index is updated per block rather than per line
+        begs = table.column('start_pos').to_numpy() - 1
+        ends = begs + pc.utf8_length(table.column('ra')).to_numpy()
+        variant_file.write_records(text, table.column('chr').to_numpy(zero_copy_only=False), begs, ends)
+    else:
+        variant_file.write(text)
+
+# Block version of process_file: reads the VCF as Arrow record batches and does the counting with array operations
+def process_file_blocks(filepath, pop_count, unique_pop_count, variant_files, af_hists, block_size=BLOCK_SIZE):
+    n_records = 0
+    vcf_output = output_format_of(variant_files) == 'vcf.gz'
+    # chr, start, rsID, reference allele, alternative allele and INFO are columns f0-f4 and f7
+    reader = pv.open_csv(
+        filepath,
+        read_options=pv.ReadOptions(skip_rows=count_header_lines(filepath), autogenerate_column_names=True, block_size=block_size),
+        parse_options=pv.ParseOptions(delimiter='\t', quote_char=False),
+        convert_options=pv.ConvertOptions(
+            include_columns=['f0', 'f1', 'f2', 'f3', 'f4', 'f7'],
+            column_types={'f0': pa.string(), 'f1': pa.int64(), 'f2': pa.string(), 'f3': pa.string(), 'f4': pa.string(), 'f7': pa.string()}
+        )
+    )
+    for batch in reader:
+        n_records += batch.num_rows
+        af = extract_af_block(batch.column('f7'))
+        present = af > 0
+        update_af_histograms_block(af_hists, af)
+
+        # Count each variant in the populations it appears in, and variants found in only one population
+        n_present = present.sum(axis=1)
+        unique = present[n_present == 1].sum(axis=0)
+        totals = present.sum(axis=0)
+
+        if vcf_output:
+            dots = pa.array(['.'] * batch.num_rows, pa.string())
+            variants = pa.table({
+                'chr': batch.column('f0'),
+                'start_pos': batch.column('f1'),
+                'rsid': batch.column('f2'),
+                'ra': batch.column('f3'),
+                'aa': batch.column('f4'),
+                'qual': dots,
+                'filter': dots,
+            })
+        else:
+            variants = pa.table({
+                'chr': batch.column('f0'),
+                'start_pos': batch.column('f1'),
+                'end_pos': pc.add(batch.column('f1'), 1),
+                'rsid': batch.column('f2'),
+                'ra': batch.column('f3'),
+                'aa': batch.column('f4'),
+            })
+        for j, pop in enumerate(populations):
+            pop_count[pop] += int(totals[j])
+            unique_pop_count[pop] += int(unique[j])
+            # write variant information to the population-specific file
+            rows = present[:, j]
+            if rows.any():
+                af_text = format_af(af[rows, j], 'AF=' if vcf_output else '')
+                write_variant_block(variant_files[pop], variants.filter(rows).append_column('af', af_text))
+    return n_records
+
+parsers = {'lines': process_file, 'blocks': process_file_blocks}
+
+# Function to run one parser over a file and report its throughput
+def timed_process(filepath, pop_count, unique_pop_count, variant_files, af_hists, parser=PARSER):
+    t0 = time.perf_counter()
+    n_records = parsers[parser](filepath, pop_count, unique_pop_count, variant_files, af_hists)
+    elapsed = time.perf_counter() - t0
+    rate = n_records / elapsed if elapsed > 0 else float('inf')
+    print(f'{os.path.basename(filepath)} [{parser}]: {n_records} records in {elapsed:.1f}s ({rate:,.0f} records/s)')
+    return n_records
+
+# Worker task: scans one chromosome file into its own counters and per-population shard files
+def scan_file(filepath, shard_dir, parser=PARSER, output_format=OUTPUT_FORMAT):
+    file_pop_count = {pop: 0 for pop in populations}
+    file_unique_pop_count = {pop: 0 for pop in populations}
+    file_af_hists = new_af_histograms()
+    base = os.path.basename(filepath)[:-len('.vcf.gz')]
+    shard_files = open_variant_files(prefix=os.path.join(shard_dir, f'{base}.'), output_format=output_format, shard=True)
+    try:
+        timed_process(filepath, file_pop_count, file_unique_pop_count, shard_files, file_af_hists, parser)
+    finally:
+        for file in shard_files.values():
+            file.close()
+    shard_paths = {pop: file.name for pop, file in shard_files.items()}
+    shard_indexes = {pop: getattr(file, 'index', None) for pop, file in shard_files.items()}
+    return file_pop_count, file_unique_pop_count, file_af_hists, shard_paths, shard_indexes
+
+# Reduce step: adds one file's counters to the totals and appends its shards to the population files
+def merge_scan_result(result, variant_files):
+    file_pop_count, file_unique_pop_count, file_af_hists, shard_paths, shard_indexes = result
+    merge_af_histograms(af_hists, file_af_hists)
+    for pop in populations:
+        pop_count[pop] += file_pop_count[pop]
+        unique_pop_count[pop] += file_unique_pop_count[pop]
+        if shard_indexes[pop] is not None:
+            # BGZF shards are appended block for block and their index entries shifted to the new offsets
+            variant_files[pop].append_bgzf(shard_paths[pop], shard_indexes[pop])
+        else:
+            with open(shard_paths[pop], 'r') as shard:
+                shutil.copyfileobj(shard, variant_files[pop])
+        os.remove(shard_paths[pop])
+
+# Helper function to sort file names in chromosome order (chr2 before chr10), so the outputs are coordinate sorted
+def chromosome_order(filename):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
 
 # Function to process all files in the folder
-def process_all_files_in_folder(folder_path):
-    for filename in os.listdir(folder_path):
+def process_all_files_in_folder(folder_path, variant_files, n_workers=1, parser=PARSER):
+    filenames = sorted((f for f in os.listdir(folder_path) if f.endswith('.vcf.gz')), key=chromosome_order)
+    filepaths = [os.path.join(folder_path, filename) for filename in filenames]
+
+    if n_workers <= 1:
+        for filename, filepath in zip(filenames, filepaths):
+            print(f'Processing file: {filename}')
+            timed_process(filepath, pop_count, unique_pop_count, variant_files, af_hists, parser)
+        return
+
+    # One task per chromosome file; results are merged in file order so the outputs match a serial run
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(scan_file, filepath, SHARD_DIR, parser, output_format_of(variant_files)) for filepath in filepaths]
+        for filename, future in zip(filenames, futures):
+            merge_scan_result(future.result(), variant_files)
+            print(f'Processed file: {filename}')
+    os.rmdir(SHARD_DIR)
+
+# Function to map every contig in the folder's bgzipped VCFs to its file and linear index (.tbi, or built once and cached)
+def index_folder_by_contig(folder_path):
+    contigs = {}
+    for filename in sorted(os.listdir(folder_path)):
         if filename.endswith('.vcf.gz'):
             filepath = os.path.join(folder_path, filename)
-            print(f'Processing file: {filename}')
-            process_file(filepath)
+            for contig, offsets in get_linear_index(filepath).items():
+                contigs[contig] = (filepath, offsets)
+    return contigs
+
+# Function to read a sorted BED file into {chrom: [(start, end, line), ...]}, keeping the file's chromosome order
+def read_sorted_bed(bed_path):
+    rows = {}
+    with open(bed_path) as f:
+        for line in f:
+            cols = line.rstrip('\n').split('\t')
+            if len(cols) < 3 or line.startswith('#'):
+                continue
+            rows.setdefault(cols[0], []).append((int(cols[1]), int(cols[2]), line.rstrip('\n')))
+    for chrom, chrom_rows in rows.items():
+        if any(a[0] > b[0] for a, b in zip(chrom_rows, chrom_rows[1:])):
+            raise ValueError(f'{bed_path}: chromosome {chrom} is not sorted by start position')
+    return rows
+
+# Function to read the records of one contig that start inside each BED interval, seeking via the linear index.
+# Uses the same convention as the scan outputs: the BED start is the VCF POS. Yields (bed_line, list of record columns).
+def query_contig(filepath, offsets, contig, bed_rows):
+    with BgzfReader(filepath) as reader:
+        records = deque()   # records already read with POS >= the current interval's start
+        done = False        # reached the end of the contig
+        for start, end, bed_line in bed_rows:
+            while records and int(records[0][1]) < start:
+                records.popleft()
+
+            # jump ahead when the next record we need is in a later block than the one we are reading
+            if not records and not done:
+                voffset = window_offset(offsets, start)
+                if voffset is None:
+                    done = True
+                elif voffset > reader.tell():
+                    reader.seek(voffset)
+
+            while not done and (not records or int(records[-1][1]) < end):
+                line = reader.readline()
+                if not line:
+                    done = True
+                    break
+                if line.startswith('#'):
+                    continue
+                cols = line.rstrip('\n').split('\t', 8)[:8]
+                if cols[0] != contig:
+                    done = True
+                    break
+                if int(cols[1]) >= start:
+                    records.append(cols)
+
+            yield bed_line, [cols for cols in records if int(cols[1]) < end]
+
+# Function to write, per population, the GWAS rows joined to the 1KGP variants at their positions.
+# Output matches `bedtools intersect -a GWAS_BED -b {pop}_variants.vcf -wo` in 1000g_gwas_bedtools.sh.
+def query_gwas_positions(folder_path, bed_path, out_prefix=''):
+    contigs = index_folder_by_contig(folder_path)
+    bed_base = os.path.splitext(os.path.basename(bed_path))[0]
+    out_files = {pop: open(f'{out_prefix}{pop}_{bed_base}.bed', 'w') for pop in populations}
+    try:
+        for chrom, bed_rows in read_sorted_bed(bed_path).items():
+            # the GWAS files use bare chromosome names; the VCF contigs may or may not have the 'chr' prefix
+            contig = next((c for c in (chrom, f'chr{chrom}', chrom.replace('chr', '', 1)) if c in contigs), None)
+            if contig is None:
+                print(f'No 1KGP contig for chromosome {chrom}, skipping {len(bed_rows)} rows')
+                continue
+            filepath, offsets = contigs[contig]
+            print(f'Querying {len(bed_rows)} positions on {contig} in {os.path.basename(filepath)}')
+            for bed_line, records in query_contig(filepath, offsets, contig, bed_rows):
+                for cols in records:
+                    start_pos = int(cols[1])
+                    for pop in populations:
+                        af = extract_af(cols[7], f'{pop}_AF=')
+                        if af > 0:
+                            out_files[pop].write(f"{bed_line}\t{cols[0]}\t{start_pos}\t{start_pos + 1}\t{cols[2]}\t{cols[3]}\t{cols[4]}\t{af}\t1\n")
+    finally:
+        for file in out_files.values():
+            file.close()
 
 # Function to save data to a text file
 def save_data_to_file(data, filename):
@@ -83,15 +415,34 @@ def save_data_to_file(data, filename):
         for pop, count in data.items():
             f.write(f'{pop}: {count}\n')
 
+# Function to save the AF histograms as tab-separated tables (rows/columns are AF bins, bin 0 is AF == 0)
+def save_af_histograms(af_hists, pop_filename, joint_filename):
+    edges = np.linspace(0, 1, N_AF_BINS + 1)
+    labels = ['0'] + [f'{lo:g}-{hi:g}' for lo, hi in zip(edges[:-1], edges[1:])]
+    with open(pop_filename, 'w') as f:
+        f.write('AF_bin\t' + '\t'.join(populations) + '\n')
+        for b, label in enumerate(labels):
+            f.write(label + '\t' + '\t'.join(str(af_hists['pop'][pop][b]) for pop in populations) + '\n')
+    with open(joint_filename, 'w') as f:
+        f.write('EUR_AF/EAS_AF\t' + '\t'.join(labels) + '\n')
+        for b, label in enumerate(labels):
+            f.write(label + '\t' + '\t'.join(str(n) for n in af_hists['EUR_EAS'][b]) + '\n')
+
 # Main execution
 if __name__ == '__main__':
-    folder_path = '/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/1KGP_hg38/'
-    process_all_files_in_folder(folder_path)
+    if MODE == 'regions':
+        # Only pull the records at the GWAS positions, writing {pop}_{GWAS_BED name}.bed
+        query_gwas_positions(FOLDER_PATH, GWAS_BED)
+    else:
+        # Initialise file for storing variants for each populations
+        variant_files = open_variant_files()
+        process_all_files_in_folder(FOLDER_PATH, variant_files, n_workers=N_WORKERS, parser=PARSER)
 
-    # Save pop_count and unique_pop_count to text files
-    save_data_to_file(pop_count, 'pop_count.txt')
-    save_data_to_file(unique_pop_count, 'unique_pop_count.txt')
+        # Save pop_count and unique_pop_count to text files
+        save_data_to_file(pop_count, 'pop_count.txt')
+        save_data_to_file(unique_pop_count, 'unique_pop_count.txt')
+        save_af_histograms(af_hists, 'af_hist.txt', 'af_hist_EUR_EAS.txt')
 
-    # close the variant files for each population
-    for file in variant_files.values():
-        file.close()
\ No newline at end of file
+        # close the variant files for each population
+        for file in variant_files.values():
+            file.close()
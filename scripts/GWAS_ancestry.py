@@ -1,10 +1,11 @@
 ## This script maps the BROAD ANCESTRAL CATEGORY from the NHGRI-EBI GWAS Catalogue to 1KGP superpopulations, and counts the number of unique studies per superpopulation and stage.
 
 import pandas as pd
+from table_cache import cached_table
 
 # Load the data
 file_path = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/NHGRI_EBI_GWAS/gwas_catalog-ancestry_r2025-02-18.tsv"
-df = pd.read_csv(file_path, delimiter="\t")
+df = cached_table(file_path, pd.read_csv, delimiter="\t")
 
 # Define mapping of broad ancestry categories to 1KGP superpopulations
 superpop_mapping = {
@@ -1,133 +1,131 @@
 #!/usr/bin/env python3
 """
-Pairs EUR/EAS variants with same phenotype & same gene, computes AF difference, and
-outputs pairs with |AF_EUR - AF_EAS| > 0.5.
+Pairs variants with same phenotype & same gene across populations, computes AF difference, and
+outputs pairs with |AF_1 - AF_2| > AF_DIFF_MIN (0.5).
 
-Produces two files:
-1) CGC-filtered:
+Produces three files:
+1) CGC-filtered, EUR vs EAS:
    cancer_type, gene, chr, start, AF_EUR, AF_EAS, AF_diff
-2) Unfiltered (no CGC constraint):
+2) Unfiltered (no CGC constraint), EUR vs EAS:
    cancer_type, gene, chr, start, AF_EUR, AF_EAS, AF_diff
+3) Every superpopulation pair, with a CGC flag:
+   cancer_type, gene, chr, start, pop_1, pop_2, AF_1, AF_2, AF_diff, in_CGC
+and a sorted index of every pair before the AF_DIFF_MIN cutoff (afdiff_index.py), for other
+thresholds and top-k queries without re-running this script.
 """
 
-import re
 import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
+from afdiff_index import COLUMNS, build_af_index
+from cancer_types import map_cancer_types
+from closest_tables import CLOSEST_IDX, GTF_FIELDS, count_columns, read_closest_table
+from gencode_store import GENCODE_VERSION, gene_names_for_gtf_columns, load_gene_store
+from instrument import phase
+from variant_keys import variant_keys
 
 # ---File Paths & Config---------
 BASE = Path("/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/preliminary_exploration/variant_selection")
 GLOB = "*_cancer_closest_genes.bed"
 OUTFILE = BASE / "both_pops_same_gene_pheno_AFdiff.tsv"             # CGC-filtered
 OUTFILE_ALL = BASE / "both_pops_same_gene_pheno_AFdiff_noCGC.tsv"   # no CGC
+OUTFILE_PAIRS = BASE / "all_pop_pairs_same_gene_pheno_AFdiff.tsv"   # all population pairs, in_CGC flag
+AF_INDEX = BASE / "all_pop_pairs_AFdiff_index.npz"                  # every pair, no AF_DIFF_MIN cutoff
+POPULATIONS = ["EUR", "EAS", "AFR", "AMR", "SAS"]                   # pairs are taken in this order; EUR-EAS first
+AF_DIFF_MIN = 0.5
 AF_COL_1BASED = 16                                                  # AF is column 16 (1-based)
 CGC_PATH = BASE / "CGC_EUR_EAS_overlap_genes.txt"
-GTf_ATTR_REGEX = re.compile(r'gene_name\s+"([^"]+)"')
 # -------------------------------
 
 # fixed indices for the bed-like file
-IDX = {"chr": 0, "start": 1, "end": 2, "rsid": 3, "phenotype": 4}
 AF_IDX0 = AF_COL_1BASED - 1  # 0-based
+IDX = {**CLOSEST_IDX, "AF": AF_IDX0}
 
-def map_cancer_type(phenotype_raw: str) -> str:
-    if not isinstance(phenotype_raw, str):
-        return "Other/General"
-    p = phenotype_raw.lower()
-    if "prostate" in p: return "Prostate"
-    if "breast" in p: return "Breast"
-    if any(k in p for k in ["colorectal","colon","rectal","rectum","crc"]): return "Colorectal"
-    if any(k in p for k in ["ovarian","ovary"]): return "Ovarian"
-    if any(k in p for k in ["nsclc","non-small cell lung","small-cell lung","sclc","lung","bronchus"]): return "Lung"
-    if any(k in p for k in ["skin","keratinocyte","non-melanoma","melanoma"]): return "Skin"
-    if any(k in p for k in ["gastric","stomach","cardia"]): return "Gastric"
-    if "pancrea" in p: return "Pancreatic"
-    if any(k in p for k in ["cervical","cervix"]): return "Cervical"
-    if "endometrial" in p: return "Endometrial"
-    if any(k in p for k in ["uterine","leiomyoma"]): return "Uterine"
-    if "bladder" in p: return "Bladder"
-    if any(k in p for k in ["kidney","renal","renal pelvis"]): return "Kidney"
-    if "thyroid" in p: return "Thyroid"
-    if any(k in p for k in ["esophageal","oesophageal","esophagus","oesophagus"]): return "Esophageal"
-    if any(k in p for k in ["testicular","germ cell"]): return "Testicular"
-    if any(k in p for k in ["liver","hepatic","intrahepatic bile duct","bile duct","gallbladder","cholangiocarcinoma"]): return "Hepatobiliary"
-    if any(k in p for k in ["brain","nervous system","glioma","glioblastoma"]): return "Brain/CNS"
-    if any(k in p for k in ["oropharynx","hypopharynx","larynx","pharynx","oral cavity","tongue","head and neck","salivary"]): return "Head & Neck"
-    if p.strip() in {"cancer"} or "cancer (" in p or "multiple cancers" in p or "hormone-sensitive cancer" in p:
-        return "Other/General"
-    return "Other/General"
+KEY = ["var_key","gene","phenotype_norm"]
 
 def infer_population_from_name(path: Path) -> str:
     name = path.name.lower()
-    if "eur" in name: return "EUR"
-    if "eas" in name: return "EAS"
+    for pop in POPULATIONS:
+        if pop.lower() in name: return pop
     return "UNK"
 
-def try_find_gene_column(df: pd.DataFrame):
-    lower_names = {str(c).lower(): i for i, c in enumerate(df.columns)}
-    for key in ["gene", "gene_symbol", "genesymbol", "symbol"]:
-        if key in lower_names:
-            return lower_names[key]
-    return None
-
 def read_cgc_symbols(path: Path) -> set:
     df = pd.read_csv(path, sep=None, engine="python")
     col = "GeneSymbol" if "GeneSymbol" in df.columns else df.columns[0]
     syms = df[col].astype(str).str.strip().str.strip('"').str.upper()
     return set(s for s in syms if s)
 
-def load_one(path: Path) -> pd.DataFrame:
-    df = pd.read_csv(path, sep="\t", header=None, dtype=str, engine="python")
-    ncol = df.shape[1]
-    core = pd.DataFrame({
-        "chr":   df.iloc[:, IDX["chr"]].astype(str),
-        "start": df.iloc[:, IDX["start"]].astype(str),
-        "end":   df.iloc[:, IDX["end"]].astype(str),
-        "rsid":  df.iloc[:, IDX["rsid"]].fillna(""),
-        "phenotype": df.iloc[:, IDX["phenotype"]].fillna("").astype(str).str.strip(),
-    })
-
+def load_one(path: Path, genes: pd.DataFrame) -> pd.DataFrame:
+    ncol = count_columns(path)
     if AF_IDX0 >= ncol:
         raise ValueError(f"{path.name}: AF column index {AF_IDX0} out of bounds for {ncol} columns")
-    core["AF"] = pd.to_numeric(df.iloc[:, AF_IDX0], errors="coerce")
+    # AF stays float64 here: AF_diff is thresholded and written out, so it must match the decimal values in the file
+    df = read_closest_table(path, ["chr", "start", "end", "rsid", "phenotype", "AF", *GTF_FIELDS], idx=IDX, af_dtype=np.float64)
+    core = pd.DataFrame({
+        "chr":   df["chr"].astype(str),
+        "start": df["start"].astype(str),
+        "end":   df["end"].astype(str),
+        "rsid":  df["rsid"],
+        "phenotype": df["phenotype"].astype(str).str.strip(),
+        "AF":    df["AF"],
+    })
 
-    gene_col_idx = try_find_gene_column(df)
-    if gene_col_idx is not None:
-        gene = df.iloc[:, gene_col_idx].astype(str)
+    if "gene" in df:
+        gene = df["gene"].astype(str)  # gene column named in the file header
+    elif IDX["gtf_attrs"] < ncol:
+        gene = gene_names_for_gtf_columns(df[GTF_FIELDS], 0, genes)
     else:
         gene = pd.Series([""] * len(df), dtype=str)
-        picked_idx = None
-        for j in range(min(ncol, 40)):
-            s = df.iloc[:, j].astype(str)
-            if s.str.contains(r'gene_name\s+"[^"]+"', regex=True).any():
-                picked_idx = j
-                g = s.str.extract(GTf_ATTR_REGEX, expand=False)
-                gene = g.fillna("").astype(str)
-                break
-        if picked_idx is None:
-            sys.stderr.write(f"[WARN] {path.name}: no gene column found; gene will be empty.\n")
+        sys.stderr.write(f"[WARN] {path.name}: no gene column found; gene will be empty.\n")
 
     core["gene"] = gene.str.strip().str.strip('"').str.upper().fillna("")
     core["population"] = infer_population_from_name(path)
     core["phenotype_norm"] = core["phenotype"].str.lower()
-    core["cancer_type"] = core["phenotype_norm"].apply(map_cancer_type)
-    core["var_key"] = core["rsid"].where(core["rsid"].ne("") & core["rsid"].notna(),
-                                         core["chr"] + ":" + core["start"] + "-" + core["end"])
+    core["cancer_type"] = map_cancer_types(core["phenotype_norm"])
+    core["var_key"] = variant_keys(core["chr"], core["start"], core["end"], core["rsid"])  # rsID, else chr:start-end
     return core
 
-def format_output(merged: pd.DataFrame) -> pd.DataFrame:
+def af_matrix(df: pd.DataFrame):
     """
-    Turn a merged (EUR/EAS) DF into:
-    cancer_type, gene, chr, start, AF_EUR, AF_EAS, AF_diff
+    One row per (var_key, gene, phenotype_norm) key, one column per population in POPULATIONS:
+    AF values (NaN where the population lacks the key) and the row of df each value came from (-1 if none).
+    df must already be deduplicated on population + KEY.
     """
-    out = pd.DataFrame({
-        "cancer_type": merged["cancer_type_EUR"],
-        "gene":        merged["gene"],
-        "chr":         merged["chr_EUR"],
-        "start":       merged["start_EUR"],
-        "AF_EUR":      merged["AF_EUR"],
-        "AF_EAS":      merged["AF_EAS"],
-        "AF_diff":     merged["AF_diff"],
+    key_idx = df.groupby(KEY, sort=False).ngroup().to_numpy()
+    pop_idx = pd.Categorical(df["population"], categories=POPULATIONS).codes
+    rows = np.full((key_idx.max() + 1 if len(df) else 0, len(POPULATIONS)), -1, dtype=np.int64)
+    known = pop_idx >= 0
+    rows[key_idx[known], pop_idx[known]] = np.flatnonzero(known)
+    af = np.where(rows >= 0, df["AF"].to_numpy(dtype=np.float64)[np.maximum(rows, 0)], np.nan)
+    return af, rows
+
+def pair_table(df: pd.DataFrame, af: np.ndarray, rows: np.ndarray, pop_1: str, pop_2: str) -> pd.DataFrame:
+    """
+    Same rows as an inner merge of the pop_1 and pop_2 tables on KEY (pop_1 rows in order), as:
+    cancer_type, gene, chr, start (all from pop_1), AF_<pop_1>, AF_<pop_2>, AF_diff, in_CGC
+    """
+    i, j = POPULATIONS.index(pop_1), POPULATIONS.index(pop_2)
+    both = np.flatnonzero((rows[:, i] >= 0) & (rows[:, j] >= 0))
+    both = both[np.argsort(rows[both, i], kind="stable")]
+    left = df.iloc[rows[both, i]]
+    return pd.DataFrame({
+        "cancer_type": left["cancer_type"].to_numpy(),
+        "gene":        left["gene"].to_numpy(),
+        "chr":         left["chr"].to_numpy(),
+        "start":       left["start"].to_numpy(),
+        f"AF_{pop_1}": af[both, i],
+        f"AF_{pop_2}": af[both, j],
+        "AF_diff":     np.abs(af[both, i] - af[both, j]),
+        "in_CGC":      left["in_CGC"].to_numpy(),
     })
+
+def format_output(pairs: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn a pair table into:
+    cancer_type, gene, chr, start, AF_<pop_1>, AF_<pop_2>, AF_diff
+    """
+    out = pairs.drop(columns=["in_CGC"])
     out = out.sort_values(by=["cancer_type","gene","AF_diff"], ascending=[True, True, False])
     return out
 
@@ -146,65 +144,65 @@ def main():
         print(f"[ERROR] No files matched {BASE / GLOB}", file=sys.stderr)
         sys.exit(2)
 
-    tables = []
-    for f in files:
-        try:
-            t = load_one(f)
-            tables.append(t)
-        except Exception as e:
-            print(f"[ERROR] Failed on {f.name}: {e}", file=sys.stderr)
-            sys.exit(3)
-
-    all_df = pd.concat(tables, ignore_index=True)
-    all_df = all_df[all_df["population"].isin(["EUR","EAS"])].copy()
-
-    # ==============================================================
-    # 1) CGC-FILTERED PATH
-    # ==============================================================
-    cgc_df = all_df[all_df["gene"].isin(cgc)].copy()
-    print(f"[INFO] CGC filter kept {len(cgc_df)}/{len(all_df)} rows.")
-
-    cgc_df = cgc_df.drop_duplicates(subset=["population","var_key","gene","phenotype_norm"]).reset_index(drop=True)
-    eur_cgc = cgc_df[cgc_df["population"]=="EUR"].copy()
-    eas_cgc = cgc_df[cgc_df["population"]=="EAS"].copy()
-
-    merged_cgc = eur_cgc.merge(
-        eas_cgc,
-        on=["var_key","gene","phenotype_norm"],
-        how="inner",
-        suffixes=("_EUR","_EAS")
-    )
-    merged_cgc["AF_diff"] = (merged_cgc["AF_EUR"] - merged_cgc["AF_EAS"]).abs()
-    before = len(merged_cgc)
-    merged_cgc = merged_cgc[merged_cgc["AF_diff"] > 0.5].copy()
-    print(f"[INFO] (CGC) Kept {len(merged_cgc)}/{before} pairs with |AF_EUR - AF_EAS| > 0.5")
-
-    out_cgc = format_output(merged_cgc)
-    OUTFILE.parent.mkdir(parents=True, exist_ok=True)
-    out_cgc.to_csv(OUTFILE, sep="\t", index=False)
-    print(f"[OK] Wrote CGC-filtered: {OUTFILE}")
-
-    # ==============================================================
-    # 2) UNFILTERED (NO CGC) PATH
-    # ==============================================================
-    all_df_nocgc = all_df.drop_duplicates(subset=["population","var_key","gene","phenotype_norm"]).reset_index(drop=True)
-    eur_all = all_df_nocgc[all_df_nocgc["population"]=="EUR"].copy()
-    eas_all = all_df_nocgc[all_df_nocgc["population"]=="EAS"].copy()
-
-    merged_all = eur_all.merge(
-        eas_all,
-        on=["var_key","gene","phenotype_norm"],
-        how="inner",
-        suffixes=("_EUR","_EAS")
-    )
-    merged_all["AF_diff"] = (merged_all["AF_EUR"] - merged_all["AF_EAS"]).abs()
-    before_all = len(merged_all)
-    merged_all = merged_all[merged_all["AF_diff"] > 0.5].copy()
-    print(f"[INFO] (noCGC) Kept {len(merged_all)}/{before_all} pairs with |AF_EUR - AF_EAS| > 0.5")
-
-    out_all = format_output(merged_all)
-    out_all.to_csv(OUTFILE_ALL, sep="\t", index=False)
-    print(f"[OK] Wrote unfiltered: {OUTFILE_ALL}")
+    with phase("load", inputs=files, files=len(files)) as rec:
+        genes = load_gene_store(GENCODE_VERSION)
+        tables = []
+        for f in files:
+            try:
+                t = load_one(f, genes)
+                tables.append(t)
+            except Exception as e:
+                print(f"[ERROR] Failed on {f.name}: {e}", file=sys.stderr)
+                sys.exit(3)
+        rec["rows_out"] = sum(len(t) for t in tables)
+
+    with phase("filter", rows_in=rec.get("rows_out")) as rec:
+        all_df = pd.concat(tables, ignore_index=True)
+        all_df = all_df[all_df["population"].isin(POPULATIONS)].copy()
+        all_df["in_CGC"] = all_df["gene"].isin(cgc)
+        print(f"[INFO] CGC filter kept {int(all_df['in_CGC'].sum())}/{len(all_df)} rows.")
+
+        # One dedup and one variants x populations AF matrix serve every population pair, with and without the CGC filter
+        all_df = all_df.drop_duplicates(subset=["population"] + KEY).reset_index(drop=True)
+        af, rows = af_matrix(all_df)
+        rec["rows_out"] = len(all_df)
+        rec["keys"] = len(af)
+
+    with phase("merge", rows_in=len(all_df)) as rec:
+        pair_tables, index_tables = [], []
+        for k, pop_1 in enumerate(POPULATIONS):
+            for pop_2 in POPULATIONS[k + 1:]:
+                pairs = pair_table(all_df, af, rows, pop_1, pop_2)
+                if (pop_1, pop_2) == ("EUR", "EAS"):
+                    eur_eas = pairs
+                long = pairs.rename(columns={f"AF_{pop_1}": "AF_1", f"AF_{pop_2}": "AF_2"}).assign(pop_1=pop_1, pop_2=pop_2)
+                index_tables.append(long)
+                pair_tables.append(long[long["AF_diff"] > AF_DIFF_MIN]
+                                   .sort_values(by=["cancer_type","gene","AF_diff"], ascending=[True, True, False]))
+        rec["rows_out"] = sum(len(t) for t in index_tables)
+
+    outputs = [OUTFILE, OUTFILE_ALL, OUTFILE_PAIRS, AF_INDEX]
+    with phase("write", rows_in=rec["rows_out"], outputs=outputs) as rec:
+        # ==============================================================
+        # 1) CGC-FILTERED PATH and 2) UNFILTERED (NO CGC) PATH, EUR vs EAS
+        # ==============================================================
+        for label, subset, outfile in [("CGC", eur_eas[eur_eas["in_CGC"]], OUTFILE), ("noCGC", eur_eas, OUTFILE_ALL)]:
+            kept = subset[subset["AF_diff"] > AF_DIFF_MIN]
+            print(f"[INFO] ({label}) Kept {len(kept)}/{len(subset)} pairs with |AF_EUR - AF_EAS| > {AF_DIFF_MIN}")
+            outfile.parent.mkdir(parents=True, exist_ok=True)
+            format_output(kept).to_csv(outfile, sep="\t", index=False)
+            print(f"[OK] Wrote {'CGC-filtered' if label == 'CGC' else 'unfiltered'}: {outfile}")
+
+        # ==============================================================
+        # 3) ALL POPULATION PAIRS
+        # ==============================================================
+        all_pairs = pd.concat(pair_tables, ignore_index=True)  # pairs in POPULATIONS order, each sorted like the EUR/EAS files
+        all_pairs[COLUMNS].to_csv(OUTFILE_PAIRS, sep="\t", index=False)
+        print(f"[OK] Wrote all population pairs ({len(all_pairs)} with |AF_1 - AF_2| > {AF_DIFF_MIN}): {OUTFILE_PAIRS}")
+
+        build_af_index(pd.concat(index_tables, ignore_index=True), AF_INDEX)
+        print(f"[OK] Wrote AF-difference index ({sum(len(t) for t in index_tables)} pairs): {AF_INDEX}")
+        rec["rows_out"] = len(all_pairs)
 
 if __name__ == "__main__":
     main()
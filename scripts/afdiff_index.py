@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Sorted index of every same-gene/same-phenotype population pair from af_diffs.py, so threshold and
+top-k queries do not need the tables to be reloaded and re-merged.
+
+The index (NPZ) stores the pair rows sorted by (pop_1, pop_2, cancer_type, gene, AF_diff descending), with
+offsets marking where each (pop_1, pop_2, cancer_type, gene) group starts. It also stores a second ordering by
+(pop_1, pop_2, cancer_type, AF_diff descending) with its own offsets, an ordering by (pop_1, pop_2, AF_diff
+descending) and a global ordering by AF_diff descending. All but the global ordering put each population pair in
+the same block of rows, whose offsets are stored too, so a --pair query only touches its own block. Thresholds are
+answered by binary search on those orderings, and top-k per group by slicing the first k rows of each group.
+
+Usage:
+  python afdiff_index.py INDEX --min-diff 0.3 [--pair EUR EAS] [--cgc] [-o out.tsv]
+  python afdiff_index.py INDEX --top-k 10 --group-by cancer_type [--min-diff 0.5] [--pair EUR EAS] [--cgc]
+"""
+
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["cancer_type","gene","chr","start","pop_1","pop_2","AF_1","AF_2","AF_diff","in_CGC"]
+STRING_COLS = ["cancer_type","gene","chr","start","pop_1","pop_2"]
+PAIR = ["pop_1","pop_2"]
+GROUP_LEVELS = {"gene": ["pop_1","pop_2","cancer_type","gene"], "cancer_type": ["pop_1","pop_2","cancer_type"]}
+
+def group_offsets(frame: pd.DataFrame, keys: list) -> np.ndarray:
+    """Start of every run of equal keys in an already-sorted frame, plus len(frame) at the end."""
+    new = np.zeros(len(frame), dtype=bool)
+    if len(frame):
+        new[0] = True
+        for k in keys:
+            col = frame[k].to_numpy()
+            new[1:] |= col[1:] != col[:-1]
+    return np.append(np.flatnonzero(new), len(frame)).astype(np.int64)
+
+def build_af_index(pairs: pd.DataFrame, path: Path) -> Path:
+    """pairs: the long all-pairs table (COLUMNS) before any AF_diff cutoff."""
+    pairs = pairs[COLUMNS].copy()
+    pairs["_neg_diff"] = -pairs["AF_diff"].to_numpy(dtype=np.float64)
+    pairs = pairs.sort_values(GROUP_LEVELS["gene"] + ["_neg_diff"], kind="stable").reset_index(drop=True)
+
+    arrays = {
+        "AF_1": pairs["AF_1"].to_numpy(np.float64),
+        "AF_2": pairs["AF_2"].to_numpy(np.float64),
+        "AF_diff": pairs["AF_diff"].to_numpy(np.float64),
+        "in_CGC": pairs["in_CGC"].to_numpy(bool),
+        "gene__offsets": group_offsets(pairs, GROUP_LEVELS["gene"]),
+        "pair__offsets": group_offsets(pairs, PAIR),
+        "pair__order": pairs.sort_values(PAIR + ["_neg_diff"], kind="stable").index.to_numpy(np.int64),
+        "by_diff": np.argsort(pairs["_neg_diff"].to_numpy(), kind="stable"),
+    }
+    by_ct = pairs.sort_values(GROUP_LEVELS["cancer_type"] + ["_neg_diff"], kind="stable")
+    arrays["cancer_type__order"] = by_ct.index.to_numpy(np.int64)
+    arrays["cancer_type__offsets"] = group_offsets(by_ct, GROUP_LEVELS["cancer_type"])
+    for col in STRING_COLS:
+        codes, categories = pd.factorize(pairs[col].astype(str))
+        arrays[f"{col}__codes"] = codes.astype(np.int32)
+        arrays[f"{col}__categories"] = np.asarray(categories, dtype=str)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(path, **arrays)
+    return path
+
+class AFDiffIndex:
+    """Loaded index; every query returns a DataFrame with COLUMNS, highest AF_diff first (within each group for top_k)."""
+
+    def __init__(self, path: Path):
+        with np.load(path, allow_pickle=False) as z:
+            self.arrays = {k: z[k] for k in z.files}
+        self.n = len(self.arrays["AF_diff"])
+        self.diff_desc = self.arrays["AF_diff"][self.arrays["by_diff"]]
+        self.pair_diff_desc = self.arrays["AF_diff"][self.arrays["pair__order"]]   # descending within each pair block
+        # (pop_1, pop_2) -> [lo, hi) rows of its block, the same in every ordering but by_diff
+        starts, ends = self.arrays["pair__offsets"][:-1], self.arrays["pair__offsets"][1:]
+        names = [self.arrays[f"{col}__categories"][self.arrays[f"{col}__codes"][starts]].tolist() for col in PAIR]
+        self.pair_spans = {(p1, p2): (lo, hi) for p1, p2, lo, hi in zip(*names, starts.tolist(), ends.tolist())}
+
+    def rows(self, idx: np.ndarray) -> pd.DataFrame:
+        a = self.arrays
+        out = {col: a[f"{col}__categories"][a[f"{col}__codes"][idx]] for col in STRING_COLS}
+        out.update({col: a[col][idx] for col in ["AF_1","AF_2","AF_diff","in_CGC"]})
+        return pd.DataFrame(out)[COLUMNS]
+
+    def span(self, pair=None) -> tuple:
+        """[lo, hi) rows of a population pair's block (all rows without a pair, empty for an unknown pair)."""
+        if pair is None:
+            return 0, self.n
+        return self.pair_spans.get(tuple(pair), (0, 0))
+
+    def above(self, min_diff: float, pair=None, cgc_only=False) -> pd.DataFrame:
+        """Pairs with AF_diff > min_diff."""
+        if pair is None:
+            order, diff_desc, lo = self.arrays["by_diff"], self.diff_desc, 0
+        else:
+            order, diff_desc = self.arrays["pair__order"], self.pair_diff_desc
+            lo, hi = self.span(pair)
+            diff_desc = diff_desc[lo:hi]
+        n = np.searchsorted(-diff_desc, -min_diff, side="left")
+        idx = order[lo:lo + n]
+        if cgc_only:
+            idx = idx[self.arrays["in_CGC"][idx]]
+        return self.rows(idx)
+
+    def top_k(self, k: int, group_by: str = "gene", min_diff: float = None, pair=None, cgc_only=False) -> pd.DataFrame:
+        """The k largest AF_diff pairs of every (pop_1, pop_2, cancer_type[, gene]) group."""
+        lo, hi = self.span(pair)
+        order = np.arange(self.n) if group_by == "gene" else self.arrays[f"{group_by}__order"]
+        positions = np.arange(lo, hi)
+        if cgc_only:
+            positions = positions[self.arrays["in_CGC"][order[lo:hi]]]
+        # group of each surviving position (binary search on the group offsets), then its rank inside the group
+        group = np.searchsorted(self.arrays[f"{group_by}__offsets"], positions, side="right") - 1
+        rank = np.arange(len(positions)) - np.searchsorted(group, group, side="left")
+        idx = order[positions[rank < k]]
+        if min_diff is not None:
+            idx = idx[self.arrays["AF_diff"][idx] > min_diff]
+        return self.rows(idx)
+
+def load_af_index(path: Path) -> AFDiffIndex:
+    return AFDiffIndex(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Threshold / top-k queries on the af_diffs.py pair index")
+    parser.add_argument("index", type=Path)
+    parser.add_argument("--min-diff", type=float, default=None, help="keep pairs with AF_diff above this")
+    parser.add_argument("--top-k", type=int, default=None, help="k largest AF_diff pairs per group")
+    parser.add_argument("--group-by", choices=sorted(GROUP_LEVELS), default="gene")
+    parser.add_argument("--pair", nargs=2, metavar=("POP_1", "POP_2"), default=None)
+    parser.add_argument("--cgc", action="store_true", help="only CGC genes")
+    parser.add_argument("-o", "--out", type=Path, default=None, help="TSV output (default: stdout)")
+    args = parser.parse_args()
+
+    index = load_af_index(args.index)
+    if args.top_k is not None:
+        result = index.top_k(args.top_k, args.group_by, args.min_diff, args.pair, args.cgc)
+    else:
+        result = index.above(args.min_diff if args.min_diff is not None else 0.5, args.pair, args.cgc)
+    result.to_csv(args.out or sys.stdout, sep="\t", index=False)
+    if args.out:
+        print(f"[OK] Wrote {len(result)} pairs: {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,37 @@
 ## Converts BED files of GWAS variants to VCF format for VEP annotation.
+## MODE = "sorted" converts the files in a process pool and writes each one sorted by (chrom, pos), without
+## duplicate records, as bgzipped VCF with ##contig lines and a .tbi index, ready for VEP. Input larger than the
+## memory budget is sorted in runs spilled to disk and merged, so memory stays flat however large the BED gets.
+## MODE = "union" writes one such VCF for all the population files together (UNION_VCF), with each variant once and
+## an INFO flag per population it is found in, so VEP annotates it once. MODE = "fan_out" then splits VEP's VCF
+## output for that file (VEP_OUTPUT) back into per-population annotated files.
 
 import os
 import glob
+import gzip
+import heapq
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from bgzf import BgzfWriter, TabixVcfWriter
 
 input_dir = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/gwas_1000_genomes"   
 output_dir = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/preliminary_exploration/vep"
 os.makedirs(output_dir, exist_ok=True)
 
+# ---------- EDIT THESE ----------
+MODE = "text"                    # "text" = unsorted plain VCF (original), "sorted" = sorted, deduplicated .vcf.gz + .tbi,
+                                 # "union" = one sorted VCF for all populations, "fan_out" = split its VEP output by population
+UNION_VCF = os.path.join(output_dir, "all_gwas_union.vcf.gz")
+VEP_OUTPUT = os.path.join(output_dir, "all_gwas_union.vep.vcf.gz")   # VEP run on UNION_VCF with --vcf (plain or gzipped)
+N_PROCS = os.cpu_count() or 1    # BED files converted at once in "sorted" and "union" mode
+MEMORY_BUDGET = 1 << 30          # bytes of VCF lines held in memory across all workers before spilling sorted runs
+TMP_DIR = None                   # directory for the spilled runs (None: the output directory)
+MAX_FAN_IN = 256                 # runs merged at once; more are first merged into bigger runs
+# -------------------------------
+
+LINE_OVERHEAD = 80               # approximate memory per held line on top of its text (str object + list slot)
+FLAG_DESCRIPTION = "Present in population"   # marks the population flags in the union VCF's ##INFO lines
+
 
 vcf_header = [
     "##fileformat=VCFv4.2",
@@ -25,41 +50,264 @@ def process_bed_to_vcf(in_path, out_path):
         for line in vcf_header:
             out.write(line + "\n")
 
-        with open(in_path, "rt") as f:
-            for raw in f:
-                s = raw.strip()
-                if not s or s.startswith("#"):
-                    continue
-                cols = s.split("\t")
-                # require minimum columns for CHR, START, END, ID, REF, ALT
-                if len(cols) < 15:
-                    continue
+        for vcf_line in vcf_lines(in_path):
+            # De-duplicate within this file
+            if vcf_line not in seen:
+                seen.add(vcf_line)
+                out.write(vcf_line + "\n")
+
+# Function to yield the VCF line for each usable BED row, in file order
+def vcf_lines(in_path):
+    with open(in_path, "rt") as f:
+        for raw in f:
+            s = raw.strip()
+            if not s or s.startswith("#"):
+                continue
+            cols = s.split("\t")
+            # require minimum columns for CHR, START, END, ID, REF, ALT
+            if len(cols) < 15:
+                continue
+
+            try:
+                chrom = cols[0]
+                start_0based = int(cols[1])    # BED start (0-based)
+                pos = start_0based + 1         # VCF POS (1-based)
+                rsid = cols[3] if cols[3] not in ("", ".") else "."
+                ref = cols[13]
+                alt = cols[14]
+            except Exception:
+                # Skip malformed rows gracefully
+                continue
+
+            # Form the VCF line
+            yield f"{chrom}\t{pos}\t{rsid}\t{ref}\t{alt}\t.\t.\t."
+
+# Function to order chromosomes naturally (1, 2, ..., 22, then X, Y, M/MT and other contigs by name), "chr" or not
+def chrom_key(chrom):
+    name = chrom[3:] if chrom.startswith("chr") else chrom
+    return (0, int(name), "") if name.isdigit() else (1, 0, name)
+
+# Sort key of a VCF line: (chrom, pos), then the whole line, so identical records end up next to each other
+def record_key(line):
+    chrom, pos, _ = line.split("\t", 2)
+    return (chrom_key(chrom), int(pos), line)
+
+# Function to drop a record equal to the one before it (input sorted by record_key)
+def dedup_adjacent(lines):
+    previous = None
+    for line in lines:
+        if line != previous:
+            yield line
+        previous = line
+
+# Function to write lines as one sorted, deduplicated run file
+def write_run(lines, tmp_dir):
+    fd, path = tempfile.mkstemp(suffix=".run", dir=tmp_dir)
+    with os.fdopen(fd, "w") as f:
+        f.writelines(line + "\n" for line in lines)
+    return path
+
+# Function to stream the lines of a run file
+def read_run(path):
+    with open(path) as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+def remove_runs(runs):
+    for run in runs:
+        if not isinstance(run, list) and os.path.exists(run):
+            os.remove(run)
+
+def sorted_runs(lines, budget, tmp_dir, keep_last=True):
+    """
+    Sorts lines into deduplicated runs: a run file each time the held lines pass budget bytes, and the rest as a
+    list (or one more file if keep_last is False, e.g. in a worker process). Returns (runs, contigs, lines read).
+    """
+    runs, held, held_bytes, contigs, n_in = [], [], 0, set(), 0
+    try:
+        for line in lines:
+            n_in += 1
+            held.append(line)
+            held_bytes += len(line) + LINE_OVERHEAD
+            if held_bytes >= budget:
+                held.sort(key=record_key)
+                runs.append(write_run(dedup_adjacent(held), tmp_dir))
+                contigs.update(l.split("\t", 1)[0] for l in held)
+                held, held_bytes = [], 0
+        held.sort(key=record_key)
+        contigs.update(l.split("\t", 1)[0] for l in held)
+        runs.append(list(dedup_adjacent(held)) if keep_last else write_run(dedup_adjacent(held), tmp_dir))
+    except BaseException:
+        remove_runs(runs)
+        raise
+    return runs, contigs, n_in
+
+# Function to merge sorted runs (lists in memory or run files) into one sorted, deduplicated stream
+def merge_runs(runs, tmp_dir):
+    merged = []   # intermediate runs made here, removed once the merge has been read
+    try:
+        # too many runs to keep open at once: merge them in groups first
+        while len(runs) > MAX_FAN_IN:
+            group = runs[:MAX_FAN_IN]
+            merged.append(write_run(merge_runs(group, tmp_dir), tmp_dir))
+            runs = runs[MAX_FAN_IN:] + merged[-1:]
+            remove_runs(group)   # frees the disk early; the caller's remove_runs skips files already gone
+        sources = [iter(run) if isinstance(run, list) else read_run(run) for run in runs]
+        yield from dedup_adjacent(heapq.merge(*sources, key=record_key))
+    finally:
+        remove_runs(merged)
+
+# Function to write sorted VCF lines as bgzipped VCF + .tbi and return the number of records
+def write_sorted_vcf(out_path, contigs, lines, info_header=()):
+    header = ([vcf_header[0]] + [f"##contig=<ID={c}>" for c in sorted(contigs, key=chrom_key)]
+              + list(info_header) + vcf_header[1:])
+    n_out, batch = 0, []
+    with TabixVcfWriter(out_path) as out:
+        out.write("\n".join(header) + "\n")
+        for line in lines:
+            batch.append(line)
+            if len(batch) == 10_000:
+                out.write("\n".join(batch) + "\n")
+                n_out, batch = n_out + len(batch), []
+        if batch:
+            out.write("\n".join(batch) + "\n")
+            n_out += len(batch)
+    return n_out
 
-                try:
-                    chrom = cols[0]
-                    start_0based = int(cols[1])    # BED start (0-based)
-                    pos = start_0based + 1         # VCF POS (1-based)
-                    rsid = cols[3] if cols[3] not in ("", ".") else "."
-                    ref = cols[13]
-                    alt = cols[14]
-
-                    # Form the VCF line
-                    vcf_line = f"{chrom}\t{pos}\t{rsid}\t{ref}\t{alt}\t.\t.\t."
-
-                    # De-duplicate within this file
-                    if vcf_line not in seen:
-                        seen.add(vcf_line)
-                        out.write(vcf_line + "\n")
-                except Exception:
-                    # Skip malformed rows gracefully
+def bed_to_sorted_vcf(in_path, out_path, budget=MEMORY_BUDGET, tmp_dir=TMP_DIR):
+    """
+    Writes the VCF lines of in_path sorted by (chrom, pos) and deduplicated, as bgzipped VCF + .tbi.
+    Lines are held until they pass budget bytes, then sorted and spilled as a run; the runs are merged at the end.
+    Returns (records read, records written).
+    """
+    tmp_dir = tmp_dir or os.path.dirname(out_path) or "."
+    runs, contigs, n_in = sorted_runs(vcf_lines(in_path), budget, tmp_dir)
+    try:
+        n_out = write_sorted_vcf(out_path, contigs, merge_runs(runs, tmp_dir))
+    finally:
+        remove_runs(runs)
+    return n_in, n_out
+
+# Function to tag each VCF line of one population's BED with the population and sort them into run files (worker side of "union")
+def population_runs(in_path, pop, budget, tmp_dir):
+    return sorted_runs((f"{line}\t{pop}" for line in vcf_lines(in_path)), budget, tmp_dir, keep_last=False)
+
+# Function to join the population tags of identical records (adjacent after sorting) into INFO flags
+def union_records(tagged, populations):
+    record, found = None, set()
+    for line in tagged:
+        line_record, pop = line.rsplit("\t", 1)
+        if line_record != record and record is not None:
+            yield record[:record.rindex("\t") + 1] + ";".join(p for p in populations if p in found)
+            found = set()
+        record = line_record
+        found.add(pop)
+    if record is not None:
+        yield record[:record.rindex("\t") + 1] + ";".join(p for p in populations if p in found)
+
+def population_flag_header(pop):
+    return f'##INFO=<ID={pop},Number=0,Type=Flag,Description="{FLAG_DESCRIPTION} {pop} ({pop}_all_gwas.bed)">'
+
+def bed_to_union_vcf(bed_paths, out_path, n_procs=N_PROCS, budget=MEMORY_BUDGET, tmp_dir=TMP_DIR):
+    """
+    Writes every population's VCF lines as one sorted VCF (bgzipped + .tbi) with each record once and INFO set to
+    the populations it occurs in, as flags. The population is the BED file name up to the first "_".
+    Returns (records read, records written, records per population).
+    """
+    tmp_dir = tmp_dir or os.path.dirname(out_path) or "."
+    pops = [os.path.basename(p).split("_")[0] for p in bed_paths]
+    populations = sorted(set(pops))
+    n_procs = max(1, min(n_procs, len(bed_paths)))
+    runs, contigs, n_in = [], set(), 0
+    try:
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            for pop_runs, pop_contigs, pop_n in pool.map(population_runs, bed_paths, pops,
+                                                         [budget // n_procs] * len(bed_paths), [tmp_dir] * len(bed_paths)):
+                runs += pop_runs
+                contigs |= pop_contigs
+                n_in += pop_n
+        per_pop = dict.fromkeys(populations, 0)
+        def counted(records):
+            for record in records:
+                for pop in record[record.rindex("\t") + 1:].split(";"):
+                    per_pop[pop] += 1
+                yield record
+        n_out = write_sorted_vcf(out_path, contigs, counted(union_records(merge_runs(runs, tmp_dir), populations)),
+                                 [population_flag_header(pop) for pop in populations])
+    finally:
+        remove_runs(runs)
+    return n_in, n_out, per_pop
+
+def fan_out_vep(vep_path, out_dir, suffix="_all_gwas.vep.vcf.gz"):
+    """
+    Splits VEP's VCF output for the union VCF into one bgzipped VCF per population (<pop><suffix>), each holding
+    the records flagged with that population, with the population flags taken out of INFO and the header.
+    Returns the records written per population.
+    """
+    opener = gzip.open if vep_path.endswith(".gz") else open
+    header, outputs, counts = [], {}, {}
+    try:
+        with opener(vep_path, "rt") as f:
+            for line in f:
+                if line.startswith("##"):
+                    header.append(line)
+                    continue
+                if line.startswith("#"):
+                    is_flag = [h.startswith("##INFO=") and f'Description="{FLAG_DESCRIPTION}' in h for h in header]
+                    pops = [h.split("ID=", 1)[1].split(",", 1)[0] for h, flag in zip(header, is_flag) if flag]
+                    if not pops:
+                        raise ValueError(f"{vep_path} has no population flags in its header; was it made from {UNION_VCF}?")
+                    kept = "".join(h for h, flag in zip(header, is_flag) if not flag)
+                    for pop in pops:
+                        outputs[pop] = BgzfWriter(os.path.join(out_dir, f"{pop}{suffix}"))
+                        outputs[pop].write(kept + line)
+                        counts[pop] = 0
+                    pop_set = set(pops)
                     continue
+                cols = line.rstrip("\n").split("\t")
+                info = cols[7].split(";")
+                rest = [x for x in info if x not in pop_set]
+                cols[7] = ";".join(rest) or "."
+                out_line = "\t".join(cols) + "\n"
+                for pop in info:
+                    if pop in pop_set:
+                        outputs[pop].write(out_line)
+                        counts[pop] += 1
+    finally:
+        for out in outputs.values():
+            out.close()
+    return counts
 
 def main():
+    if MODE == "fan_out":
+        counts = fan_out_vep(VEP_OUTPUT, output_dir)
+        for pop, n in counts.items():
+            print(f"Wrote: {os.path.join(output_dir, pop + '_all_gwas.vep.vcf.gz')} ({n} records)")
+        return
+
     bed_paths = glob.glob(os.path.join(input_dir, "*_all_gwas.bed"))
     if not bed_paths:
         print(f"No files matching *_all.bed found in {input_dir}")
         return
 
+    if MODE == "union":
+        n_in, n_out, per_pop = bed_to_union_vcf(sorted(bed_paths), UNION_VCF)
+        print(f"Wrote: {UNION_VCF} ({n_out} distinct records from {n_in} across {len(per_pop)} populations; "
+              f"{sum(per_pop.values()) / max(n_out, 1):.2f} populations per record)")
+        for pop, n in per_pop.items():
+            print(f"  {pop}: {n} records")
+        return
+
+    if MODE == "sorted":
+        n_procs = max(1, min(N_PROCS, len(bed_paths)))
+        out_paths = [os.path.join(output_dir, os.path.splitext(os.path.basename(bed))[0] + ".vcf.gz") for bed in bed_paths]
+        with ProcessPoolExecutor(max_workers=n_procs) as pool:
+            # the budget is shared between the workers running at once
+            results = pool.map(bed_to_sorted_vcf, bed_paths, out_paths, [MEMORY_BUDGET // n_procs] * len(bed_paths))
+            for out_vcf, (n_in, n_out) in zip(out_paths, results):
+                print(f"Wrote: {out_vcf} ({n_out} of {n_in} records after removing duplicates)")
+        return
+
     for bed in bed_paths:
         base = os.path.splitext(os.path.basename(bed))[0]
         out_vcf = os.path.join(output_dir, f"{base}.vcf")
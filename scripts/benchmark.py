@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Times every Python stage of the pipeline on synthetic inputs (synthetic_data.py) and compares the results with a
+stored baseline. Everything runs offline.
+
+The scripts are copied into WORK_DIR/scripts with the cluster directory replaced by WORK_DIR, then run one at a
+time as subprocesses from the directory they expect. Each stage records:
+  - wall time (best of --repeat runs, 3 by default)
+  - peak RSS of the stage's process (VmHWM on Linux, wait4's ru_maxrss elsewhere)
+  - input rows and rows/s
+Inputs are counted as text lines, or Parquet rows for the GTEx files. A stage slower than the baseline by more
+than TOLERANCE (and SLACK_S seconds), or using more memory by that margin, is reported as a regression and gives exit code 1.
+
+Usage:
+  python benchmark.py [--work-dir /tmp/phd_bench] [--scale 20000] [--stages af_diffs get_eQTLs] [--repeat 3]
+  python benchmark.py --save-baseline        # record this run as the baseline (benchmark_baseline.json, default scale)
+"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+import pyarrow.parquet as pq
+from synthetic_data import POPULATIONS, generate
+
+# ---------- EDIT THESE ----------
+CLUSTER_DIR = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd"   # rewritten to the work directory in the copied scripts
+SCRIPTS = Path(__file__).resolve().parent
+WORK_DIR = Path("/tmp/phd_bench")
+BASELINE = SCRIPTS / "benchmark_baseline.json"
+TOLERANCE = 0.25   # fractional slowdown / memory growth reported as a regression
+SLACK_S = 0.2      # ...beyond this many seconds, so sub-second stages do not flag on timer noise
+# -------------------------------
+
+# Copies of a script with settings in its EDIT THESE block changed, timed as stages of their own, so the other modes
+# of a script are benchmarked too: copy name -> (script, {setting line: replacement})
+VARIANTS = {
+    "1KGP_population_variants_vcfgz.py": ("1KGP_population_variants.py", {"OUTPUT_FORMAT = 'text'": "OUTPUT_FORMAT = 'vcf.gz'"}),
+    "1KGP_population_variants_regions.py": ("1KGP_population_variants.py", {"MODE = 'scan'": "MODE = 'regions'"}),
+}
+
+# name, script, working directory (relative to the work dir), input files (globs relative to the work dir),
+# outputs that must hold data rows (glob, header lines), so a stage cannot pass by running on empty frames
+SEL = "preliminary_exploration/variant_selection"
+STAGES = [
+    ("phenotype_modifier", "phenotype_modifier.py", "scripts", ["NHGRI_EBI_GWAS/gwas_catalog_v1.0-associations_*.tsv"],
+     [("NHGRI_EBI_GWAS/all_gwas.bed", 0)]),
+    ("GWAS_ancestry", "GWAS_ancestry.py", "scripts", ["NHGRI_EBI_GWAS/gwas_catalog-ancestry_*.tsv"], []),
+    ("1KGP_population_variants", "1KGP_population_variants.py", ".", ["1KGP_hg38/*.vcf.gz"],
+     [(f"{pop}_variants.vcf", 0) for pop in POPULATIONS] + [("pop_count.txt", 0), ("af_hist.txt", 1)]),
+    ("1KGP_population_variants_vcfgz", "1KGP_population_variants_vcfgz.py", ".", ["1KGP_hg38/*.vcf.gz"],
+     [(f"{pop}_variants.vcf.gz", 1) for pop in POPULATIONS]),
+    ("1KGP_population_variants_regions", "1KGP_population_variants_regions.py", ".", ["NHGRI_EBI_GWAS/all_gwas.bed"],
+     [(f"{pop}_all_gwas.bed", 0) for pop in POPULATIONS]),
+    ("gencode_file_modification", "gencode_file_modification.py", ".",
+     ["gencode.v47.annotation.gtf.gz", "gwas_1000_genomes/*_all_gwas.bed"], [("preliminary_exploration/gencode/*_gencode.vcf", 0)]),
+    ("bed_to_vcf", "bed_to_vcf.py", "scripts", ["gwas_1000_genomes/*_all_gwas.bed"], [("preliminary_exploration/vep/*_all_gwas.vcf", 1)]),
+    ("get_eQTLs", "get_eQTLs.py", ".", ["GTEx_hg38_v10/*.parquet", "gwas_1000_genomes/*_all_gwas.bed"], [("*_all_GTEx.bed", 0)]),
+    ("CGC_file_reformatting", "CGC_file_reformatting.py", "scripts", [f"{SEL}/Cosmic_CGC.tsv"], []),
+    ("CGC_associated_variants", "CGC_associated_variants.py", "scripts", [f"{SEL}/E*_cancer_closest_genes.bed"],
+     [(f"{SEL}/unique_E*_by_phenotype.tsv", 1), (f"{SEL}/triplet_overlap*.tsv", 1)]),
+    ("unique_cancer_variants", "unique_cancer_variants.py", "scripts", [f"{SEL}/E*_cancer_closest_genes.bed"],
+     [(f"{SEL}/unique_E*_by_phenotype_noCGC.tsv", 1), (f"{SEL}/gene_cancer_pairs_popSpecific_both*.tsv", 1)]),
+    ("af_diffs", "af_diffs.py", "scripts", [f"{SEL}/*_cancer_closest_genes.bed"],
+     [(f"{SEL}/both_pops_same_gene_pheno_AFdiff*.tsv", 1), (f"{SEL}/all_pop_pairs_same_gene_pheno_AFdiff.tsv", 1)]),
+]
+
+def count_rows(path: Path) -> int:
+    if path.suffix == ".parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    with (gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")) as f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b""))
+
+# Function to list the expected outputs of a stage that are missing or hold no data rows
+def empty_outputs(work_dir: Path, outputs) -> list:
+    empty = []
+    for pattern, header in outputs:
+        paths = sorted(work_dir.glob(pattern))
+        if not paths:
+            empty.append(pattern)
+        for p in paths:
+            with (gzip.open(p, "rb") if p.suffix == ".gz" else open(p, "rb")) as f:
+                lines = (line for line in f if not line.startswith(b"##"))   # VCF meta lines are not counted
+                if sum(1 for _ in zip(range(header + 1), lines)) <= header:
+                    empty.append(str(p.relative_to(work_dir)))
+    return empty
+
+def copy_scripts(work_dir: Path):
+    """Copies every script with the cluster paths pointing at work_dir, plus the VARIANTS copies."""
+    out = work_dir / "scripts"
+    out.mkdir(parents=True, exist_ok=True)
+    for src in SCRIPTS.glob("*.py"):
+        (out / src.name).write_text(src.read_text().replace(CLUSTER_DIR, str(work_dir)))
+    for name, (script, settings) in VARIANTS.items():
+        text = (out / script).read_text()
+        for line, replacement in settings.items():
+            if line not in text:
+                raise ValueError(f"{script} has no line '{line}' to make {name} from")
+            text = text.replace(line, replacement, 1)
+        (out / name).write_text(text)
+
+# Runs a script as __main__ and writes its own peak RSS (VmHWM, KiB) on the way out. A forked child's ru_maxrss
+# starts at the parent's size on Linux, so the child's high-water mark is read from /proc after exec instead.
+RUNNER = """
+import os, runpy, sys
+script, rss_file = sys.argv[1], sys.argv[2]
+sys.argv = [script]
+sys.path.insert(0, os.path.dirname(script))
+try:
+    runpy.run_path(script, run_name="__main__")
+finally:
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f, open(rss_file, "w") as out:
+            out.write(next(line.split()[1] for line in f if line.startswith("VmHWM")))
+"""
+
+# Function to run one script as a child process and return (exit code, wall seconds, peak RSS in MB)
+def run_once(script: Path, cwd: Path, log, metrics: Path = None):
+    env = dict(os.environ, TABLE_CACHE="0")  # time the text parsing, not the table cache
+    if metrics:
+        env.update(INSTRUMENT="1", INSTRUMENT_LOG=str(metrics))   # per-phase records from instrument.py
+    rss_file = cwd / f".{script.stem}.rss"
+    rss_file.unlink(missing_ok=True)
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", RUNNER, str(script), str(rss_file)],
+                            cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - t0
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if rss_file.exists():
+        rss_mb = int(rss_file.read_text()) / 1024
+        rss_file.unlink()
+    else:
+        rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)  # bytes on macOS, KiB elsewhere
+    return proc.returncode, wall, rss_mb
+
+def run_benchmarks(work_dir: Path, names=None, repeat=1) -> dict:
+    results = {}
+    log_dir = work_dir / "bench_logs"
+    log_dir.mkdir(exist_ok=True)
+    for name, script, cwd, inputs, outputs in STAGES:
+        if names and name not in names:
+            continue
+        rows = sum(count_rows(p) for pattern in inputs for p in sorted(work_dir.glob(pattern)))
+        best = None
+        metrics = log_dir / f"{name}.metrics.jsonl"
+        metrics.unlink(missing_ok=True)
+        with open(log_dir / f"{name}.log", "w") as log:
+            for _ in range(repeat):
+                rc, wall, rss = run_once(work_dir / "scripts" / script, work_dir / cwd, log, metrics)
+                if rc != 0:
+                    best = None
+                    break
+                best = (wall, rss) if best is None or wall < best[0] else best
+        if best is None:
+            print(f"[ERROR] {name}: exit code {rc}, see {log_dir / name}.log")
+            results[name] = {"status": "failed", "rows": rows}
+            continue
+        empty = empty_outputs(work_dir, outputs)
+        if empty:
+            print(f"[ERROR] {name}: no data rows in {', '.join(empty)}")
+            results[name] = {"status": "empty", "rows": rows}
+            continue
+        wall, rss = best
+        results[name] = {"status": "ok", "rows": rows, "wall_s": round(wall, 3),
+                         "rows_per_s": round(rows / wall, 1), "peak_rss_mb": round(rss, 1)}
+        print(f"[OK] {name}: {wall:.2f}s, {rows / wall:,.0f} rows/s, peak RSS {rss:.0f} MB")
+    return results
+
+# Function to print each stage against the baseline and return the regressed stage names
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    regressed = []
+    print(f"\n{'stage':<34}{'wall_s':>9}{'base':>9}{'ratio':>8}{'rss_MB':>9}{'base':>9}")
+    for name, r in results.items():
+        b = baseline.get("stages", {}).get(name)
+        if r["status"] != "ok" or not b or b.get("status") != "ok":
+            print(f"{name:<34}{r.get('wall_s', '-'):>9}{'-':>9}{'-':>8}{r.get('peak_rss_mb', '-'):>9}{'-':>9}")
+            continue
+        ratio = r["wall_s"] / b["wall_s"] if b["wall_s"] else float("inf")
+        flag = ""
+        if r["wall_s"] > b["wall_s"] * (1 + tolerance) + SLACK_S or r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + tolerance):
+            regressed.append(name)
+            flag = "  <- regression"
+        print(f"{name:<34}{r['wall_s']:>9.2f}{b['wall_s']:>9.2f}{ratio:>8.2f}{r['peak_rss_mb']:>9.0f}{b['peak_rss_mb']:>9.0f}{flag}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data")
+    parser.add_argument("--work-dir", type=Path, default=WORK_DIR)
+    parser.add_argument("--scale", type=int, default=20_000, help="synthetic variants (see synthetic_data.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=None, choices=[s[0] for s in STAGES])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest is kept")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--keep-data", action="store_true", help="reuse the synthetic inputs already in --work-dir")
+    parser.add_argument("-o", "--out", type=Path, default=None, help="results JSON (default: WORK_DIR/benchmark_results.json)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir.resolve()
+    if not (args.keep_data and (work_dir / "NHGRI_EBI_GWAS").exists()):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        counts = generate(work_dir, args.scale, args.seed)
+        print(f"[INFO] Synthetic inputs in {work_dir}: " + ", ".join(f"{k}={n}" for k, n in counts.items()))
+    copy_scripts(work_dir)
+
+    results = {"scale": args.scale, "seed": args.seed, "python": platform.python_version(), "machine": platform.node(),
+               "stages": run_benchmarks(work_dir, args.stages, args.repeat)}
+    out = args.out or work_dir / "benchmark_results.json"
+    out.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"[OK] Results: {out}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"[OK] Saved baseline: {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"[WARN] No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("scale") != args.scale:
+        print(f"[WARN] Baseline was recorded at scale {baseline.get('scale')}, this run used {args.scale}")
+    regressed = compare(results["stages"], baseline, TOLERANCE)
+    if regressed:
+        print(f"[ERROR] Slower or larger than the baseline by more than {TOLERANCE:.0%}: {', '.join(regressed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
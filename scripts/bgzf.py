@@ -0,0 +1,409 @@
+## Minimal BGZF (blocked gzip) reader/writer and tabix index helpers for bgzipped, indexed VCFs.
+
+import gzip
+import os
+import struct
+import zlib
+import numpy as np
+
+TABIX_WINDOW_SHIFT = 14   # tabix linear index uses 16 kb windows
+
+
+class BgzfReader:
+    """Reads lines from a BGZF file and supports seeking to tabix virtual offsets (block offset << 16 | offset in block)."""
+
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        self._block_start = 0   # compressed offset of the current block
+        self._block_size = 0    # compressed size of the current block
+        self._data = b''        # decompressed contents of the current block
+        self._within = 0        # read position within self._data
+        self._load_block(0)
+
+    def _load_block(self, coffset):
+        self._f.seek(coffset)
+        header = self._f.read(12)
+        self._block_start = coffset
+        self._within = 0
+        if len(header) < 12:
+            # end of file
+            self._block_size = 0
+            self._data = b''
+            return
+        if header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError(f'{self._f.name}: not a BGZF file (bad block header at offset {coffset})')
+        xlen = struct.unpack('<H', header[10:12])[0]
+        extra = self._f.read(xlen)
+
+        # the 'BC' extra subfield holds the total block size minus one
+        bsize = None
+        i = 0
+        while i + 4 <= xlen:
+            si1, si2, slen = extra[i], extra[i + 1], struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack('<H', extra[i + 4:i + 6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError(f'{self._f.name}: BGZF block at offset {coffset} has no BC field')
+
+        self._block_size = bsize + 1
+        cdata = self._f.read(self._block_size - 12 - xlen)[:-8]  # drop CRC32 + ISIZE
+        self._data = zlib.decompress(cdata, -15)
+
+    def seek(self, voffset):
+        coffset, within = voffset >> 16, voffset & 0xFFFF
+        if coffset != self._block_start or self._block_size == 0:
+            self._load_block(coffset)
+        self._within = within
+
+    def tell(self):
+        return (self._block_start << 16) | self._within
+
+    def readline(self):
+        parts = []
+        while True:
+            i = self._data.find(b'\n', self._within)
+            if i >= 0:
+                parts.append(self._data[self._within:i + 1])
+                self._within = i + 1
+                break
+            parts.append(self._data[self._within:])
+            if self._block_size == 0:
+                break
+            self._load_block(self._block_start + self._block_size)
+        return b''.join(parts).decode()
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to read the linear index of a tabix (.tbi) file: {contig: [smallest virtual offset for each 16 kb window]}
+def read_tabix_linear_index(tbi_path):
+    with gzip.open(tbi_path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'TBI\x01':
+        raise ValueError(f'{tbi_path}: not a tabix index')
+    n_ref, _fmt, _col_seq, _col_beg, _col_end, _meta, _skip, l_nm = struct.unpack('<8i', data[4:36])
+    names = data[36:36 + l_nm].split(b'\x00')[:n_ref]
+    pos = 36 + l_nm
+
+    linear = {}
+    for name in names:
+        # skip the binning index; the linear index alone is enough to find where a position starts
+        n_bin = struct.unpack('<i', data[pos:pos + 4])[0]
+        pos += 4
+        for _ in range(n_bin):
+            n_chunk = struct.unpack('<i', data[pos + 4:pos + 8])[0]
+            pos += 8 + 16 * n_chunk
+        n_intv = struct.unpack('<i', data[pos:pos + 4])[0]
+        pos += 4
+        linear[name.decode()] = list(struct.unpack(f'<{n_intv}Q', data[pos:pos + 8 * n_intv]))
+        pos += 8 * n_intv
+    return linear
+
+
+# Function to build the same linear index by scanning a bgzipped VCF once (for files without a .tbi)
+def build_linear_index(vcf_path):
+    linear = {}
+    with BgzfReader(vcf_path) as reader:
+        while True:
+            voffset = reader.tell()
+            line = reader.readline()
+            if not line:
+                break
+            if line.startswith('#'):
+                continue
+            chrom, pos = line.split('\t', 2)[:2]
+            window = (int(pos) - 1) >> TABIX_WINDOW_SHIFT
+            offsets = linear.setdefault(chrom, [])
+            while len(offsets) <= window:
+                offsets.append(voffset)
+    return linear
+
+
+# Function to save/load a linear index built by build_linear_index as text (one line per contig)
+def save_linear_index(linear, path):
+    with open(path, 'w') as f:
+        for chrom, offsets in linear.items():
+            f.write(chrom + '\t' + ','.join(map(str, offsets)) + '\n')
+
+def load_linear_index(path):
+    linear = {}
+    with open(path) as f:
+        for line in f:
+            chrom, offsets = line.rstrip('\n').split('\t')
+            linear[chrom] = [int(x) for x in offsets.split(',')] if offsets else []
+    return linear
+
+
+# Function to get the linear index for a bgzipped VCF: the .tbi if there is one, else a cached .lidx built on first use
+def get_linear_index(vcf_path):
+    tbi_path = vcf_path + '.tbi'
+    if os.path.exists(tbi_path):
+        return read_tabix_linear_index(tbi_path)
+    lidx_path = vcf_path + '.lidx'
+    if os.path.exists(lidx_path) and os.path.getmtime(lidx_path) >= os.path.getmtime(vcf_path):
+        return load_linear_index(lidx_path)
+    linear = build_linear_index(vcf_path)
+    try:
+        save_linear_index(linear, lidx_path)
+    except OSError:
+        pass  # read-only data directory; the index is rebuilt next time
+    return linear
+
+
+# Function to look up the virtual offset to start reading from for a 1-based position (None if past the last record)
+def window_offset(offsets, pos):
+    window = max(pos - 1, 0) >> TABIX_WINDOW_SHIFT
+    if window >= len(offsets):
+        return None
+    return offsets[window]
+
+
+# ---------- Writing ----------
+
+BGZF_BLOCK_SIZE = 0xff00  # uncompressed bytes per block (same as htslib, so even incompressible data fits in a block)
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+class BgzfWriter:
+    """Buffered BGZF writer: text is collected until a full block is ready, then compressed and written in one go."""
+
+    def __init__(self, path, level=6):
+        self.name = path
+        self._f = open(path, 'wb')
+        self._buf = bytearray()
+        self._level = level
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        bsize = 18 + len(cdata) + 8
+        header = struct.pack('<4BIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, 66, 67, 2, bsize - 1)
+        self._f.write(header + cdata + struct.pack('<II', zlib.crc32(data), len(data)))
+
+    def write(self, data):
+        """Buffers data and writes out every full block. Returns the compressed offsets of the blocks the buffered
+        bytes ended up in: byte i of (old buffer + data) is at virtual offset coffsets[i // BGZF_BLOCK_SIZE] << 16 | i % BGZF_BLOCK_SIZE."""
+        if isinstance(data, str):
+            data = data.encode()
+        self._buf += data
+        coffsets = []
+        while len(self._buf) >= BGZF_BLOCK_SIZE:
+            coffsets.append(self._f.tell())
+            self._write_block(bytes(self._buf[:BGZF_BLOCK_SIZE]))
+            del self._buf[:BGZF_BLOCK_SIZE]
+        coffsets.append(self._f.tell())
+        return coffsets
+
+    def flush_block(self):
+        if self._buf:
+            self._write_block(bytes(self._buf))
+            self._buf.clear()
+
+    def tell(self):
+        return (self._f.tell() << 16) | len(self._buf)
+
+    def append_bgzf(self, path):
+        """Copies the blocks of another BGZF file (minus its EOF marker) and returns the offset they start at."""
+        self.flush_block()
+        coffset = self._f.tell()
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data.endswith(BGZF_EOF):
+            data = data[:-len(BGZF_EOF)]
+        self._f.write(data)
+        return coffset
+
+    def close(self):
+        self.flush_block()
+        self._f.write(BGZF_EOF)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to compute the tabix/UCSC bin for a 0-based, half-open interval
+def reg2bin(beg, end):
+    end -= 1
+    if beg >> 14 == end >> 14: return 4681 + (beg >> 14)
+    if beg >> 17 == end >> 17: return 585 + (beg >> 17)
+    if beg >> 20 == end >> 20: return 73 + (beg >> 20)
+    if beg >> 23 == end >> 23: return 9 + (beg >> 23)
+    if beg >> 26 == end >> 26: return 1 + (beg >> 26)
+    return 0
+
+# Vectorised reg2bin for numpy arrays of intervals
+def reg2bin_array(begs, ends):
+    ends = ends - 1
+    bins = np.zeros(len(begs), dtype=np.int64)
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        same = (begs >> shift) == (ends >> shift)
+        bins[same] = offset + (begs[same] >> shift)
+    return bins
+
+
+class TabixIndex:
+    """Tabix binning + linear index built record by record while a coordinate-sorted file is written."""
+
+    def __init__(self):
+        self.contigs = {}    # contig -> (bins {bin: [[vbeg, vend], ...]}, linear [voffset per 16 kb window])
+        self._last = None    # (contig, beg) of the previous record, to check the sort order
+
+    def add(self, contig, beg, end, vbeg, vend):
+        if self._last is not None and contig == self._last[0]:
+            if beg < self._last[1]:
+                raise ValueError(f'records are not sorted: {contig}:{beg + 1} comes after {contig}:{self._last[1] + 1}')
+        elif contig in self.contigs:
+            raise ValueError(f'records for {contig} are not contiguous')
+        self._last = (contig, beg)
+
+        end = max(end, beg + 1)
+        bins, linear = self.contigs.setdefault(contig, ({}, []))
+        chunks = bins.setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == vbeg:
+            chunks[-1][1] = vend
+        else:
+            chunks.append([vbeg, vend])
+        # records arrive sorted, so only windows past the end of the linear index can still be unset
+        for window in range(max(beg >> TABIX_WINDOW_SHIFT, len(linear)), ((end - 1) >> TABIX_WINDOW_SHIFT) + 1):
+            while len(linear) < window:
+                linear.append(None)
+            linear.append(vbeg)
+
+    def add_many(self, contig, begs, ends, vbegs, vends):
+        """Vectorised add() for consecutive, sorted records on one contig (numpy int64 arrays)."""
+        if len(begs) == 0:
+            return
+        if np.any(np.diff(begs) < 0):
+            raise ValueError(f'records are not sorted on {contig}')
+        # checks the order against the previous record and sets up the contig
+        self.add(contig, int(begs[0]), int(ends[0]), int(vbegs[0]), int(vends[0]))
+        self._last = (contig, int(begs[-1]))
+        if len(begs) == 1:
+            return
+
+        begs, ends, vbegs, vends = begs[1:], np.maximum(ends[1:], begs[1:] + 1), vbegs[1:], vends[1:]
+        bins, linear = self.contigs[contig]
+
+        # runs of back-to-back records in the same bin become one chunk
+        rec_bins = reg2bin_array(begs, ends)
+        breaks = np.flatnonzero((rec_bins[1:] != rec_bins[:-1]) | (vbegs[1:] != vends[:-1])) + 1
+        for s, e in zip(np.r_[0, breaks].tolist(), (np.r_[breaks, len(begs)] - 1).tolist()):
+            chunks = bins.setdefault(int(rec_bins[s]), [])
+            if chunks and chunks[-1][1] == vbegs[s]:
+                chunks[-1][1] = int(vends[e])
+            else:
+                chunks.append([int(vbegs[s]), int(vends[e])])
+
+        # linear index: the first record covering each window not yet in the index
+        w_beg, w_end = begs >> TABIX_WINDOW_SHIFT, (ends - 1) >> TABIX_WINDOW_SHIFT
+        windows, first = np.unique(w_beg, return_index=True)
+        first_record = dict(zip(windows.tolist(), first.tolist()))
+        for i in np.flatnonzero(w_end > w_beg).tolist():
+            for window in range(int(w_beg[i]) + 1, int(w_end[i]) + 1):
+                if first_record.get(window, i + 1) > i:
+                    first_record[window] = i
+        for window in sorted(first_record):
+            if window >= len(linear):
+                while len(linear) < window:
+                    linear.append(None)
+                linear.append(int(vbegs[first_record[window]]))
+
+    def update(self, other, coffset=0):
+        """Adds the contigs of an index for a file whose blocks were appended at compressed offset coffset."""
+        shift = coffset << 16
+        for contig, (bins, linear) in other.contigs.items():
+            if contig in self.contigs:
+                raise ValueError(f'records for {contig} are not contiguous')
+            self.contigs[contig] = (
+                {b: [[vbeg + shift, vend + shift] for vbeg, vend in chunks] for b, chunks in bins.items()},
+                [None if v is None else v + shift for v in linear],
+            )
+        self._last = None
+
+    def write_tbi(self, path, fmt=2, col_seq=1, col_beg=2, col_end=0, meta='#'):
+        """Writes a .tbi file; the defaults are tabix's VCF preset."""
+        names = b''.join(contig.encode() + b'\x00' for contig in self.contigs)
+        out = [b'TBI\x01', struct.pack('<8i', len(self.contigs), fmt, col_seq, col_beg, col_end, ord(meta), 0, len(names)), names]
+        for bins, linear in self.contigs.values():
+            out.append(struct.pack('<i', len(bins)))
+            for b, chunks in bins.items():
+                out.append(struct.pack('<Ii', b, len(chunks)))
+                out.append(b''.join(struct.pack('<QQ', vbeg, vend) for vbeg, vend in chunks))
+            # windows with no records point at the next record: no earlier record overlaps an empty window, so a
+            # query there loses nothing by starting at it (htslib instead fills them forward from the previous window)
+            filled = list(linear)
+            for i in range(len(filled) - 2, -1, -1):
+                if filled[i] is None:
+                    filled[i] = filled[i + 1]
+            out.append(struct.pack(f'<i{len(filled)}Q', len(filled), *filled))
+        with BgzfWriter(path) as f:
+            f.write(b''.join(out))
+
+
+class TabixVcfWriter(BgzfWriter):
+    """Writes coordinate-sorted VCF text as BGZF and indexes each record; the .tbi is written next to it on close.
+
+    With index_path=None no .tbi is written and the index is left in .index (e.g. for shards appended later)."""
+
+    def __init__(self, path, index_path='', level=6):
+        super().__init__(path, level)
+        self.index = TabixIndex()
+        self.index_path = path + '.tbi' if index_path == '' else index_path
+
+    def write(self, text):
+        data = text.encode()
+        offset = len(self._buf)  # position of data within the not-yet-written stream
+        coffsets = super().write(data)
+
+        # index each (newline-terminated) line from its byte range, converted to virtual offsets via the blocks it went to
+        lines = data.split(b'\n')
+        lines.pop()
+        for line in lines:
+            start, offset = offset, offset + len(line) + 1
+            if line.startswith(b'#'):
+                continue
+            chrom, pos, _id, ref = line.split(b'\t', 4)[:4]
+            beg = int(pos) - 1
+            vbeg = (coffsets[start // BGZF_BLOCK_SIZE] << 16) | (start % BGZF_BLOCK_SIZE)
+            vend = (coffsets[offset // BGZF_BLOCK_SIZE] << 16) | (offset % BGZF_BLOCK_SIZE)
+            self.index.add(chrom.decode(), beg, beg + len(ref), vbeg, vend)
+
+    def write_records(self, text, contigs, begs, ends):
+        """Faster write() for text holding exactly one line per record, with the records' contigs (numpy array)
+        and 0-based begin/end coordinates already known, so the index is updated with array operations."""
+        data = text.encode()
+        offset = len(self._buf)
+        coffsets = np.array(super(TabixVcfWriter, self).write(data), dtype=np.int64)
+
+        stops = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1 + offset
+        starts = np.r_[offset, stops[:-1]]
+        vbegs = (coffsets[starts // BGZF_BLOCK_SIZE] << 16) | (starts % BGZF_BLOCK_SIZE)
+        vends = (coffsets[stops // BGZF_BLOCK_SIZE] << 16) | (stops % BGZF_BLOCK_SIZE)
+
+        # one add_many per run of records on the same contig
+        breaks = np.flatnonzero(contigs[1:] != contigs[:-1]) + 1
+        for s, e in zip(np.r_[0, breaks].tolist(), np.r_[breaks, len(contigs)].tolist()):
+            self.index.add_many(str(contigs[s]), begs[s:e], ends[s:e], vbegs[s:e], vends[s:e])
+
+    def append_bgzf(self, path, index=None):
+        coffset = super().append_bgzf(path)
+        if index is not None:
+            self.index.update(index, coffset)
+        return coffset
+
+    def close(self):
+        super().close()
+        if self.index_path:
+            self.index.write_tbi(self.index_path)
@@ -0,0 +1,57 @@
+## Maps free-text GWAS phenotypes to broad cancer types. Shared by CGC_associated_variants.py, unique_cancer_variants.py and af_diffs.py.
+
+import re
+from functools import lru_cache
+import pandas as pd
+
+# Keyword table in precedence order: more specific/site terms before broad ones, first listed type wins
+CANCER_TYPE_KEYWORDS = [
+    ("Prostate",      ["prostate"]),
+    ("Breast",        ["breast"]),
+    ("Colorectal",    ["colorectal", "colon", "rectal", "rectum", "crc"]),
+    ("Ovarian",       ["ovarian", "ovary"]),
+    ("Lung",          ["nsclc", "non-small cell lung", "small-cell lung", "sclc", "lung", "bronchus"]),
+    ("Skin",          ["skin", "keratinocyte", "non-melanoma", "melanoma"]),
+    ("Gastric",       ["gastric", "stomach", "cardia"]),
+    ("Pancreatic",    ["pancrea"]),
+    ("Cervical",      ["cervical", "cervix"]),
+    ("Endometrial",   ["endometrial"]),
+    ("Uterine",       ["uterine", "leiomyoma"]),
+    ("Bladder",       ["bladder"]),
+    ("Kidney",        ["kidney", "renal", "renal pelvis"]),
+    ("Thyroid",       ["thyroid"]),
+    ("Esophageal",    ["esophageal", "oesophageal", "esophagus", "oesophagus"]),
+    ("Testicular",    ["testicular", "germ cell"]),
+    ("Hepatobiliary", ["liver", "hepatic", "intrahepatic bile duct", "bile duct", "gallbladder", "cholangiocarcinoma"]),
+    ("Brain/CNS",     ["brain", "nervous system", "glioma", "glioblastoma"]),
+    ("Head & Neck",   ["oropharynx", "hypopharynx", "larynx", "pharynx", "oral cavity", "tongue", "head and neck", "salivary"]),
+]
+# Broad/unspecific phenotypes ("cancer", "multiple cancers", ...) and anything unmatched
+DEFAULT_TYPE = "Other/General"
+
+# One alternation inside a lookahead, so every start position reports a keyword (no consumed text hides an overlapping one).
+# Alternatives are listed in precedence order, so at each position the highest-precedence keyword starting there is the
+# one captured; the best rank over all positions is then the type the original if-chain would return.
+_ALTERNATION = "|".join(f"(?P<t{rank}>{'|'.join(re.escape(k) for k in keywords)})"
+                        for rank, (_, keywords) in enumerate(CANCER_TYPE_KEYWORDS))
+_PATTERN = re.compile(f"(?=(?:{_ALTERNATION}))")
+
+
+@lru_cache(maxsize=None)
+def _classify(p: str) -> str:
+    ranks = [int(m.lastgroup[1:]) for m in _PATTERN.finditer(p)]
+    return CANCER_TYPE_KEYWORDS[min(ranks)][0] if ranks else DEFAULT_TYPE
+
+
+def map_cancer_type(phenotype_raw: str) -> str:
+    """Map free-text phenotype to a broad cancer type."""
+    if not isinstance(phenotype_raw, str):
+        return DEFAULT_TYPE
+    return _classify(phenotype_raw.lower())
+
+
+def map_cancer_types(phenotypes: pd.Series) -> pd.Series:
+    """map_cancer_type for a whole column, evaluated once per distinct phenotype."""
+    codes, uniques = pd.factorize(phenotypes)
+    types = pd.Index([map_cancer_type(p) for p in uniques] + [DEFAULT_TYPE], dtype=object)
+    return pd.Series(types.take(codes), index=phenotypes.index, dtype=object)  # code -1 (missing) -> DEFAULT_TYPE
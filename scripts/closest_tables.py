@@ -0,0 +1,80 @@
+## Fast typed loader for the bedtools-closest "*_cancer_closest_genes.bed" tables
+## (GWAS + 1KGP variant columns, then the simplified GTF columns of the closest feature, then the distance).
+
+import numpy as np
+import pandas as pd
+from table_cache import cached_table
+
+# fixed column indices (0-based) of the bedtools-closest outputs
+CLOSEST_IDX = {
+    "chr": 0, "start": 1, "end": 2, "rsid": 3, "phenotype": 4, "AF": 15,
+    "gtf_chr": 17, "gtf_start": 18, "gtf_end": 19, "gtf_strand": 20, "gtf_feature": 21, "gtf_attrs": 22,
+    "dist": 23,
+}
+# the six simplified-GTF columns, in file order (see gencode_store.gene_names_for_gtf_columns)
+GTF_FIELDS = ["gtf_chr", "gtf_start", "gtf_end", "gtf_strand", "gtf_feature", "gtf_attrs"]
+
+INT_FIELDS = {"start", "end", "gtf_start", "gtf_end", "dist"}
+CATEGORICAL_FIELDS = {"chr", "phenotype", "gtf_chr", "gtf_strand", "gtf_feature"}
+GENE_HEADER_NAMES = ["gene", "gene_symbol", "genesymbol", "symbol"]
+PARSER_VERSION = 1  # bump when parse_closest_table's output changes, so cached tables are re-parsed
+
+def sniff_header(path) -> list:
+    """Column names if the first line is a header (its start column is not a number), else None."""
+    with open(path) as f:
+        first = f.readline().rstrip("\n").split("\t")
+    start = first[CLOSEST_IDX["start"]] if len(first) > CLOSEST_IDX["start"] else ""
+    return None if start.lstrip("-").isdigit() else first
+
+def count_columns(path) -> int:
+    with open(path) as f:
+        return len(f.readline().rstrip("\n").split("\t"))
+
+def read_closest_table(path, fields, idx=CLOSEST_IDX, af_dtype=np.float32) -> pd.DataFrame:
+    """parse_closest_table, served from the table cache when the file has not changed since it was last parsed."""
+    return cached_table(path, parse_closest_table, PARSER_VERSION, fields=list(fields), idx=dict(idx), af_dtype=af_dtype)
+
+def parse_closest_table(path, fields, idx=CLOSEST_IDX, af_dtype=np.float32) -> pd.DataFrame:
+    """Reads only the requested fields with the C parser.
+
+    Coordinates and distance come back as Int64 and AF as af_dtype. chr, phenotype and the GTF
+    chr/strand/feature columns are categorical, and missing strings are "". A field whose index
+    lies beyond the file width is all-NA. If the file has a header with a gene column
+    (gene / gene_symbol / genesymbol / symbol), it is returned as "gene"."""
+    header = sniff_header(path)
+    ncol = len(header) if header is not None else count_columns(path)
+
+    cols = {f: idx[f] for f in fields if idx[f] < ncol}
+    if header is not None:
+        lower = [str(c).strip().lower() for c in header]
+        gene_col = next((lower.index(name) for name in GENE_HEADER_NAMES if name in lower), None)
+        if gene_col is not None:
+            cols["gene"] = gene_col
+
+    typed = {i: ("Int64" if f in INT_FIELDS else af_dtype if f == "AF" else "category" if f in CATEGORICAL_FIELDS else str)
+             for f, i in cols.items()}
+    read = dict(sep="\t", header=None, skiprows=1 if header is not None else 0, usecols=sorted(cols.values()),
+                engine="c", low_memory=False)
+    try:
+        raw = pd.read_csv(path, dtype=typed, **read)
+    except (ValueError, TypeError):
+        # a placeholder such as "." in a numeric column: read those as text and coerce
+        raw = pd.read_csv(path, dtype={i: ("category" if t == "category" else str) for i, t in typed.items()}, **read)
+
+    out = pd.DataFrame(index=raw.index)
+    for f in list(fields) + (["gene"] if "gene" in cols else []):
+        if f not in cols:
+            out[f] = pd.Series(pd.NA, index=raw.index, dtype="Int64" if f in INT_FIELDS else object)
+            continue
+        s = raw[cols[f]]
+        if f in INT_FIELDS and s.dtype != "Int64":
+            s = pd.to_numeric(s, errors="coerce").astype("Int64")
+        elif f == "AF" and s.dtype != af_dtype:
+            s = pd.to_numeric(s, errors="coerce").astype(af_dtype)
+        elif isinstance(s.dtype, pd.CategoricalDtype):
+            if s.isna().any():
+                s = s.cat.add_categories([""]).fillna("") if "" not in s.cat.categories else s.fillna("")
+        elif f not in INT_FIELDS and f != "AF":
+            s = s.fillna("")
+        out[f] = s
+    return out
@@ -2,28 +2,62 @@
 
 import gzip
 import os
-import subprocess
+import numpy as np
+from gencode_store import GENCODE_VERSION, build_gene_store, load_gene_store, store_is_current
+from intervals import IntervalIndex, format_wo, read_intervals, write_lines
+
+# ---------- EDIT THESE ----------
+FEATURE_LEVELS = None      # e.g. ['gene', 'exon', 'CDS', 'UTR'] to intersect only those GTF feature types; None keeps all
+COLLAPSE_TO_GENE = False   # True: one row per variant-gene, keeping the most specific overlapping feature
+# -------------------------------
+
+# GTF feature types from most to least specific
+FEATURE_SPECIFICITY = ['start_codon', 'stop_codon', 'Selenocysteine', 'CDS', 'UTR', 'exon', 'transcript', 'gene']
+
+# Function to keep, for every (variant, gene) pair, only the overlap with the most specific feature
+def most_specific_per_gene(a_idx, b_idx, gene_codes, feature_rank):
+    order = np.lexsort((b_idx, feature_rank[b_idx], gene_codes[b_idx], a_idx))
+    a_sorted, gene_sorted = a_idx[order], gene_codes[b_idx][order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (a_sorted[1:] != a_sorted[:-1]) | (gene_sorted[1:] != gene_sorted[:-1])
+    keep = np.sort(order[first])  # back to -wo order (by variant, then GTF row)
+    return a_idx[keep], b_idx[keep]
 
 # --- 1. Process and simplify the GENCODE GTF file ---
 gencode_input_path = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/gencode.v47.annotation.gtf.gz"
 gencode_output_path = "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/preliminary_exploration/gencode/gencode_hg38_v47.gtf.gz"
 
-with gzip.open(gencode_input_path, 'rt') as infile, gzip.open(gencode_output_path, 'wb') as outfile:
-    for line in infile:
-        if line.startswith('#'):
-            continue
-        cols = line.strip().split('\t')
-        if len(cols) < 9:
-            continue  # skip malformed lines
-        chr = cols[0].replace('chr', '')
-        feature = cols[2]
-        start_pos = cols[3]
-        end_pos = cols[4]
-        strand = cols[6]
-        info = cols[8]
-
-        output_line = f"{chr}\t{start_pos}\t{end_pos}\t{strand}\t{feature}\t{info}\n"
-        outfile.write(output_line.encode('utf-8'))
+# Plain-text copy of the simplified GTF for the bedtools/awk shell scripts (gencode_breakdown.sh,
+# gene_feature_coverage.sh, intersect_population_variants_with_genes.sh, run_closest_population_specific_variants.sh)
+gtf_unzipped = gencode_output_path[:-len('.gz')]
+
+# Helper function to check whether an output is missing or older than the GTF
+def is_stale(path):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(gencode_input_path)
+
+# Only re-simplify when the GTF is newer than the existing outputs; both are written in the same pass, so they always match
+if is_stale(gencode_output_path) or is_stale(gtf_unzipped):
+    with gzip.open(gencode_input_path, 'rt') as infile, gzip.open(gencode_output_path, 'wb') as outfile, open(gtf_unzipped, 'w') as plainfile:
+        for line in infile:
+            if line.startswith('#'):
+                continue
+            cols = line.strip().split('\t')
+            if len(cols) < 9:
+                continue  # skip malformed lines
+            chr = cols[0].replace('chr', '')
+            feature = cols[2]
+            start_pos = cols[3]
+            end_pos = cols[4]
+            strand = cols[6]
+            info = cols[8]
+
+            output_line = f"{chr}\t{start_pos}\t{end_pos}\t{strand}\t{feature}\t{info}\n"
+            outfile.write(output_line.encode('utf-8'))
+            plainfile.write(output_line)
+
+# Typed GENCODE store (interned gene_id/gene_name/gene_type/feature + int coordinates), rebuilt whenever the GTF changes
+if not store_is_current(GENCODE_VERSION, gencode_input_path):
+    build_gene_store(GENCODE_VERSION, gencode_input_path)
 
 # --- 2. Process population-specific GWAS files into simplified BED files ---
 
@@ -59,33 +93,40 @@ for pop in populations:
 
             outfile.write(f"{chr}\t{start_pos}\t{end_pos}\t{rsid}\t{pheno}\n")
 
-# --- 3. Run bedtools intersect for each population ---
+# --- 3. Intersect each population with the GTF (same output as bedtools intersect -wo) ---
+
+# Output columns:
+#   "CHR", "start_pos", "end_pos", "RSID", "Phenotype",                            # from BED
+#   "chr_gtf", "gtf_start", "gtf_end", "gtf_strand", "gtf_feature", "gtf_info",  # from GTF
+#   "overlap_length"                                                             # from -wo
+# With COLLAPSE_TO_GENE the GTF columns are those of the most specific feature hit for each variant-gene.
 
-gtf_unzipped = gencode_output_path.rstrip('.gz')  # Expected output filename after unzip
-gtf_for_bedtools = gtf_unzipped
+# Load and index the GTF once (read straight from the .gz, no unzipped copy needed)
+gtf = read_intervals(gencode_output_path)
 
-# Unzip the GTF if needed (bedtools needs plain text input)
-if not os.path.exists(gtf_unzipped):
-    subprocess.run(["gunzip", "-k", gencode_output_path])
+# feature type and gene of every GTF row come from the typed store (row i of the store is line i of the simplified GTF)
+genes = load_gene_store(GENCODE_VERSION)
+if len(genes) != len(gtf):
+    raise ValueError(f"GENCODE store has {len(genes)} rows but {gencode_output_path} has {len(gtf)}; delete the store to rebuild it")
+if FEATURE_LEVELS is not None:
+    keep = genes['feature'].isin(FEATURE_LEVELS).to_numpy()
+    gtf = gtf[keep].reset_index(drop=True)
+    genes = genes[keep].reset_index(drop=True)
+gene_codes = genes['gene_id'].cat.codes.to_numpy()
+rank = {feature: i for i, feature in enumerate(FEATURE_SPECIFICITY)}
+feature_rank = genes['feature'].astype(str).map(rank).fillna(len(rank)).to_numpy(dtype=np.int64)
 
-#header = [
-    "CHR", "start_pos", "end_pos", "RSID", "Phenotype",          # from BED
-    "chr_gtf", "gtf_start", "gtf_end", "gtf_strand", "gtf_feature", "gtf_info",  # from GTF
-    "overlap_length"  # from -wo]
+gtf_index = IntervalIndex.from_frame(gtf)
 
-# Run bedtools intersect
 for pop in populations:
     input_bed = os.path.join(output_dir, f"{pop}_all_gwas.bed")
     output_vcf = os.path.join(output_dir, f"{pop}_gencode.vcf")
 
-    command = [
-        "bedtools", "intersect",
-        "-a", input_bed,
-        "-b", gtf_for_bedtools,
-        "-wo"
-    ]
+    variants = read_intervals(input_bed)
+    a_idx, b_idx = gtf_index.overlaps(variants['chrom'].to_numpy(), variants['start'].to_numpy(), variants['end'].to_numpy())
+    if COLLAPSE_TO_GENE:
+        a_idx, b_idx = most_specific_per_gene(a_idx, b_idx, gene_codes, feature_rank)
 
-    with open(output_vcf, "w") as outfile:
-        subprocess.run(command, stdout=outfile)
+    write_lines(format_wo(variants, gtf, a_idx, b_idx), output_vcf)
 
-    print(f"Finished bedtools for {pop}: {output_vcf}")
\ No newline at end of file
+    print(f"Finished intersect for {pop}: {output_vcf}")
\ No newline at end of file
@@ -0,0 +1,123 @@
+## Builds a compact columnar copy of the GENCODE GTF once (NPZ: integer coordinates plus interned gene_id, gene_name, gene_type and feature),
+## so scripts can read typed gene columns instead of re-parsing the free-text attribute column every run.
+## The store records the size and mtime of the GTF it was built from and is rebuilt when the GTF changes.
+
+import gzip
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# ---------- EDIT THESE ----------
+GENCODE_VERSION = 47
+GENCODE_DIR = Path("/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd")
+STORE_DIR = GENCODE_DIR / "preliminary_exploration/gencode"
+# -------------------------------
+
+CATEGORICAL_COLS = ["chrom", "strand", "feature", "gene_id", "gene_name", "gene_type"]
+ATTR_PATTERNS = {
+    "gene_id":   r'gene_id\s+"([^"]+)"',
+    "gene_name": r'gene_name\s+"([^"]+)"',
+    "gene_type": r'gene_type\s+"([^"]+)"',
+}
+
+def gtf_path(version: int = GENCODE_VERSION) -> Path:
+    return GENCODE_DIR / f"gencode.v{version}.annotation.gtf.gz"
+
+def store_path(version: int = GENCODE_VERSION, store_dir: Path = STORE_DIR) -> Path:
+    return Path(store_dir) / f"gencode_v{version}_annotation.npz"
+
+def source_fingerprint(gtf: Path) -> np.ndarray:
+    st = Path(gtf).stat()
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+def store_is_current(version: int = GENCODE_VERSION, gtf: Path = None, store_dir: Path = STORE_DIR) -> bool:
+    """True if the store exists and was built from the GTF as it is now (a missing GTF leaves the store as it is)."""
+    path, gtf = store_path(version, store_dir), Path(gtf or gtf_path(version))
+    if not path.exists():
+        return False
+    if not gtf.exists():
+        return True
+    with np.load(path, allow_pickle=False) as z:
+        return "source" in z.files and np.array_equal(z["source"], source_fingerprint(gtf))
+
+def count_header_lines(path: Path) -> int:
+    with gzip.open(path, "rt") as f:
+        n = 0
+        for line in f:
+            if not line.startswith("#"):
+                break
+            n += 1
+    return n
+
+def parse_gtf(path: Path) -> pd.DataFrame:
+    """One pass over the GTF; chromosome names lose the 'chr' prefix, as in the simplified GTF from gencode_file_modification.py.
+    Rows stay in file order, so row i of the store is line i of the simplified GTF."""
+    gtf = pd.read_csv(path, sep="\t", header=None, skiprows=count_header_lines(path), usecols=[0, 2, 3, 4, 6, 8],
+                      dtype={0: str, 2: str, 3: np.int64, 4: np.int64, 6: str, 8: str}, quoting=3)
+    attrs = gtf[8]
+    out = pd.DataFrame({
+        "chrom":   gtf[0].str.replace("chr", "", regex=False),
+        "start":   gtf[3],
+        "end":     gtf[4],
+        "strand":  gtf[6],
+        "feature": gtf[2],
+    })
+    for col, pat in ATTR_PATTERNS.items():
+        out[col] = attrs.str.extract(pat, expand=False).fillna("")
+    for col in CATEGORICAL_COLS:
+        out[col] = out[col].astype("category")
+    return out
+
+def build_gene_store(version: int = GENCODE_VERSION, gtf: Path = None, store_dir: Path = STORE_DIR) -> Path:
+    gtf = gtf or gtf_path(version)
+    ann = parse_gtf(gtf)
+    arrays = {"start": ann["start"].to_numpy(np.int64), "end": ann["end"].to_numpy(np.int64),
+              "source": source_fingerprint(gtf)}
+    for col in CATEGORICAL_COLS:
+        arrays[f"{col}__codes"] = ann[col].cat.codes.to_numpy(np.int32)
+        arrays[f"{col}__categories"] = np.asarray(ann[col].cat.categories, dtype=str)
+    out = store_path(version, store_dir)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(out, **arrays)
+    print(f"[OK] Wrote GENCODE v{version} store ({len(ann)} rows): {out}")
+    return out
+
+def load_gene_store(version: int = GENCODE_VERSION, store_dir: Path = STORE_DIR, build: bool = True) -> pd.DataFrame:
+    """Typed GENCODE table for one release; builds the store from the GTF first if it is missing or the GTF changed."""
+    path = store_path(version, store_dir)
+    if not store_is_current(version, store_dir=store_dir):
+        if not build:
+            raise FileNotFoundError(f"No current GENCODE v{version} store at {path}")
+        build_gene_store(version, store_dir=store_dir)
+    with np.load(path, allow_pickle=False) as z:
+        out = pd.DataFrame({"start": z["start"], "end": z["end"]})
+        for col in CATEGORICAL_COLS:
+            out[col] = pd.Categorical.from_codes(z[f"{col}__codes"], categories=z[f"{col}__categories"])
+    return out[["chrom", "start", "end", "strand", "feature", "gene_id", "gene_name", "gene_type"]]
+
+def gene_names_for_gtf_columns(df: pd.DataFrame, first_col: int, store: pd.DataFrame) -> pd.Series:
+    """gene_name for rows of a bedtools output that carry the six simplified-GTF columns
+    (chr, start, end, strand, feature, attributes) from column first_col on.
+
+    Rows are matched to the store on (chr, start, end, strand, feature). The attribute string is only
+    parsed for the few rows whose coordinates are shared by features of different genes."""
+    key = ["chrom", "start", "end", "strand", "feature"]
+    rows = pd.DataFrame({
+        "chrom":   df.iloc[:, first_col].astype(str),
+        "start":   pd.to_numeric(df.iloc[:, first_col + 1], errors="coerce").astype("Int64"),
+        "end":     pd.to_numeric(df.iloc[:, first_col + 2], errors="coerce").astype("Int64"),
+        "strand":  df.iloc[:, first_col + 3].astype(str),
+        "feature": df.iloc[:, first_col + 4].astype(str),
+    })
+    keys = store[key + ["gene_name"]].astype({"chrom": str, "strand": str, "feature": str, "gene_name": str,
+                                             "start": "Int64", "end": "Int64"}).drop_duplicates()
+    keys = keys[~keys.duplicated(subset=key, keep=False)]
+    gene = rows.merge(keys, on=key, how="left")["gene_name"]
+    gene.index = df.index
+
+    ambiguous = gene.isna()
+    if ambiguous.any():
+        attrs = df.loc[ambiguous, df.columns[first_col + 5]].fillna("").astype(str)
+        gene[ambiguous] = attrs.str.extract(re.compile(ATTR_PATTERNS["gene_name"]), expand=False)
+    return gene.fillna("")
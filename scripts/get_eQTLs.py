@@ -1,58 +1,175 @@
-## Script to extract eQTL variant information from GTEx parquet files, format it into BED format, and find intersections with population-specific GWAS variants using bedtools.
+## Script to extract eQTL variant information from GTEx parquet files, format it into BED format, and find intersections with population-specific GWAS variants (bedtools intersect done in memory).
 
-import pandas as pd
 import os
 import glob
-import subprocess
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pandas as pd
+from instrument import phase
+from intervals import IntervalIndex, format_intersect, read_intervals, write_lines
 
 input_folder = '/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/GTEx_hg38_v10'
 output_file = '/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/all_GTEx_hg38_v10.bed'
-unique_lines = set()
+N_THREADS = os.cpu_count() or 1   # tissue files decoded concurrently
+WRITE_CHUNK = 1 << 20             # output rows formatted per write
+POPULATIONS = ['AFR', 'AMR', 'EAS', 'EUR', 'SAS']
+summary_file = 'GTEx_overlap_summary.tsv'
+
+# Function to read the distinct variant IDs of one tissue file (only the variant_id column is decoded),
+# split into chrom / pos / ref / alt / the rest of the ID (e.g. "b38")
+def read_variant_parts(fragment):
+    ids = pc.drop_null(pc.unique(fragment.to_table(columns=["variant_id"], use_threads=False).column("variant_id")))
+    ids = ids.filter(pc.greater_equal(pc.count_substring(ids, "_"), 4))  # ensure at least 4 underscores
+    parts = pc.split_pattern(ids, "_", max_splits=4)
+    return {
+        "chrom": pc.list_element(parts, 0),
+        "pos": pc.cast(pc.list_element(parts, 1), pa.int64()).to_numpy(zero_copy_only=False),
+        "ref": pc.list_element(parts, 2),
+        "alt": pc.list_element(parts, 3),
+        "rest": pc.list_element(parts, 4),
+    }
+
+# Function to map strings onto integer codes, growing the vocabulary (an Arrow string array) with unseen values
+def intern(values, vocab):
+    new = pc.unique(values)
+    new = new.filter(pc.invert(pc.is_in(new, value_set=vocab)))
+    vocab = pa.concat_arrays([vocab, new.cast(vocab.type)])
+    return pc.index_in(values, value_set=vocab).to_numpy(zero_copy_only=False).astype(np.int64), vocab
+
+# Function to check that the interned codes and positions fit the bit fields of the packed keys:
+# key1 = rest (23 bits) << 40 | chrom (8 bits) << 32 | pos (32 bits), key2 = ref (31 bits) << 32 | alt (32 bits).
+# A value outside its field would overlap its neighbour (or overflow int64) and silently merge different variants.
+def check_key_bounds(pos, chrom_vocab, allele_vocab, rest_vocab):
+    for name, vocab, bits in [("chromosome", chrom_vocab, 8), ("allele", allele_vocab, 31), ("variant ID suffix", rest_vocab, 23)]:
+        if len(vocab) > 1 << bits:
+            raise ValueError(f"{len(vocab)} distinct {name} values; the packed variant keys hold at most {1 << bits}")
+    if len(pos) and (pos.min() < 0 or pos.max() >= 1 << 32):
+        raise ValueError(f"position {pos.min() if pos.min() < 0 else pos.max()} is outside the 32-bit field of the packed variant keys")
+
+# Function to sort integer key columns together and drop repeated keys
+def unique_keys(*keys):
+    order = np.lexsort(keys[::-1])
+    keys = [k[order] for k in keys]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = False
+    for k in keys:
+        keep[1:] |= k[1:] != k[:-1]
+    return [k[keep] for k in keys]
+
+# Function to rank each vocabulary entry in sorted string order
+def vocab_rank(vocab):
+    rank = np.empty(len(vocab), dtype=np.int64)
+    rank[pc.sort_indices(vocab).to_numpy()] = np.arange(len(vocab))
+    return rank
+
+# Function to intersect one population's GWAS variants with the eQTL positions, write {pop}_all_GTEx.bed and count the hits
+def overlap_population(pop, eqtls, eqtl_index):
+    gwas = read_intervals(f"gwas_1000_genomes/{pop}_all_gwas.bed")
+    a_idx, b_idx = eqtl_index.overlaps(gwas['chrom'].to_numpy(), gwas['start'].to_numpy(), gwas['end'].to_numpy())
+    write_lines(format_intersect(gwas, eqtls, a_idx, b_idx), f"{pop}_all_GTEx.bed")
+    return {'population': pop, 'gwas_rows': len(gwas), 'gwas_rows_with_eQTL': len(np.unique(a_idx)), 'overlap_rows': len(a_idx)}
 
 # Find all matching parquet files
 parquet_files = glob.glob(os.path.join(input_folder, "*.v10.eQTLs.signif_pairs.parquet"))
+dataset = ds.dataset(parquet_files, format="parquet")
 
-for parquet_file in parquet_files:
-    print(f"Processing {os.path.basename(parquet_file)}")
-    
-    try:
-        df = pd.read_parquet(parquet_file, columns=["variant_id"])
-    except Exception as e:
-        print(f"Error reading {parquet_file}: {e}")
-        continue
-
-    # Drop any missing or malformed variant IDs
-    df = df.dropna(subset=["variant_id"])
-    df = df[df["variant_id"].str.count("_") >= 4]  # ensure at least 4 underscores
-
-    # Split variant_id into components
-    parts = df["variant_id"].str.split("_", expand=True)
-    df["chrom"] = parts[0]
-    df["start"] = parts[1].astype(int)
-    df["end"] = df["start"] + 1
-    df["ref"] = parts[2]
-    df["alt"] = parts[3]
-    df["change"] = df["ref"] + "->" + df["alt"]
-    df["dot"] = "."
-
-    # Combine into tab-separated format
-    for row in df.itertuples(index=False):
-        line = f"{row.chrom}\t{row.start}\t{row.end}\t{row.variant_id}\t{row.change}\t{row.dot}"
-        unique_lines.add(line)
-
-# Write to file
-with open(output_file, 'w') as f:
-    for line in sorted(unique_lines):
-        f.write(line + "\n")
+# Every distinct variant becomes two int64 keys, (rest, chrom, pos) and (ref, alt), with the strings interned into vocabularies
+chrom_vocab, allele_vocab, rest_vocab = (pa.array([], pa.string()) for _ in range(3))
+key1, key2 = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+pending = []
+
+with phase("read", inputs=parquet_files, files=len(parquet_files)) as rec:
+    with ThreadPoolExecutor(max_workers=N_THREADS) as executor:
+        # at most N_THREADS fragments in flight, and each future dropped once consumed, so only the tissues being
+        # decoded (plus the running key set) are held, not every tissue's parsed parts
+        fragments = iter(dataset.get_fragments())
+        futures = {}
+        for fragment in itertools.islice(fragments, N_THREADS):
+            futures[executor.submit(read_variant_parts, fragment)] = fragment.path
+        while futures:
+            future = next(as_completed(futures))
+            path = futures.pop(future)
+            fragment = next(fragments, None)
+            if fragment is not None:
+                futures[executor.submit(read_variant_parts, fragment)] = fragment.path
+            print(f"Processing {os.path.basename(path)}")
+            try:
+                parts = future.result()
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            del future
+
+            chrom, chrom_vocab = intern(parts["chrom"], chrom_vocab)
+            ref, allele_vocab = intern(parts["ref"], allele_vocab)
+            alt, allele_vocab = intern(parts["alt"], allele_vocab)
+            rest, rest_vocab = intern(parts["rest"], rest_vocab)
+            check_key_bounds(parts["pos"], chrom_vocab, allele_vocab, rest_vocab)
+            pending.append(((rest << 40) | (chrom << 32) | parts["pos"], (ref << 32) | alt))
+            del parts, chrom, ref, alt, rest
+
+            # fold new keys into the running unique set once they outnumber it (keeps peak memory near the final size)
+            if sum(len(k1) for k1, _ in pending) >= len(key1):
+                key1, key2 = unique_keys(np.concatenate([key1] + [k1 for k1, _ in pending]),
+                                         np.concatenate([key2] + [k2 for _, k2 in pending]))
+                pending = []
+
+    key1, key2 = unique_keys(np.concatenate([key1] + [k1 for k1, _ in pending]),
+                             np.concatenate([key2] + [k2 for _, k2 in pending]))
+    rec["rows_out"] = len(key1)
+
+with phase("write", rows_in=len(key1), outputs=[output_file]):
+    # Sort like `sort -k1,1 -k2,2n` (chromosome name, then numeric position), then ref and alt
+    chrom = (key1 >> 32) & 0xFF
+    pos = key1 & 0xFFFFFFFF
+    rest = key1 >> 40
+    ref = key2 >> 32
+    alt = key2 & 0xFFFFFFFF
+    allele_rank = vocab_rank(allele_vocab)
+    order = np.lexsort((vocab_rank(rest_vocab)[rest], allele_rank[alt], allele_rank[ref], pos, vocab_rank(chrom_vocab)[chrom]))
+
+    # Write to file in chunks, building the lines in Arrow rather than as Python strings
+    schema = pa.schema([(name, pa.string()) for name in ["chrom", "start", "end", "variant_id", "change", "dot"]])
+    write_options = pv.WriteOptions(include_header=False, delimiter="\t", quoting_style="none")
+    with pv.CSVWriter(output_file, schema, write_options=write_options) as writer:
+        for lo in range(0, len(order), WRITE_CHUNK):
+            rows = order[lo:lo + WRITE_CHUNK]
+            c = chrom_vocab.take(pa.array(chrom[rows]))
+            r = allele_vocab.take(pa.array(ref[rows]))
+            a = allele_vocab.take(pa.array(alt[rows]))
+            start = pa.array(pos[rows]).cast(pa.string())
+            writer.write_table(pa.table({
+                "chrom": c,
+                "start": start,
+                "end": pa.array(pos[rows] + 1).cast(pa.string()),
+                "variant_id": pc.binary_join_element_wise(c, start, r, a, rest_vocab.take(pa.array(rest[rows])), "_"),
+                "change": pc.binary_join_element_wise(r, a, "->"),
+                "dot": pa.repeat(pa.scalar(".", pa.string()), len(rows)),
+            }, schema=schema))
 
 print(f"Done. Output saved to: {output_file}")
 
 
 
-# Run bedtool sintersect to find the number of phenotype-associated variants in each population that are associated with eQTL variants
-subprocess.call("bedtools intersect -a gwas_1000_genomes/AFR_all_gwas.bed -b all_GTEx_hg38_v10.bed > AFR_all_GTEx.bed", shell=True)
-subprocess.call("bedtools intersect -a gwas_1000_genomes/AMR_all_gwas.bed -b all_GTEx_hg38_v10.bed > AMR_all_GTEx.bed", shell=True)
-subprocess.call("bedtools intersect -a gwas_1000_genomes/EAS_all_gwas.bed -b all_GTEx_hg38_v10.bed > EAS_all_GTEx.bed", shell=True)
-subprocess.call("bedtools intersect -a gwas_1000_genomes/EUR_all_gwas.bed -b all_GTEx_hg38_v10.bed > EUR_all_GTEx.bed", shell=True)
-subprocess.call("bedtools intersect -a gwas_1000_genomes/SAS_all_gwas.bed -b all_GTEx_hg38_v10.bed > SAS_all_GTEx.bed", shell=True)
-print("bedtool sintersect run for each population with GETx file")
\ No newline at end of file
+# Intersect each population with the eQTL positions to find the number of phenotype-associated variants in each population that are associated with eQTL variants
+# (same output as bedtools intersect -a gwas_1000_genomes/{pop}_all_gwas.bed -b all_GTEx_hg38_v10.bed > {pop}_all_GTEx.bed)
+# The reference is indexed once from the keys already in memory, and the populations run concurrently against it.
+eqtls = pd.DataFrame({
+    'chrom': chrom_vocab.to_numpy(zero_copy_only=False)[chrom[order]],
+    'start': pos[order],
+    'end': pos[order] + 1,
+})
+eqtl_index = IntervalIndex.from_frame(eqtls)
+
+with phase("overlap", rows_in=len(eqtls), outputs=[f"{pop}_all_GTEx.bed" for pop in POPULATIONS]) as rec:
+    with ThreadPoolExecutor(max_workers=min(N_THREADS, len(POPULATIONS))) as executor:
+        summary = pd.DataFrame(executor.map(lambda pop: overlap_population(pop, eqtls, eqtl_index), POPULATIONS))
+    rec["rows_out"] = int(summary["overlap_rows"].sum())
+summary.to_csv(summary_file, sep="\t", index=False)
+print(summary.to_string(index=False))
+print(f"intersect run for each population with GTEx file; summary saved to: {summary_file}")
@@ -0,0 +1,170 @@
+## Structured per-phase telemetry for the analysis scripts. Wrap a phase (load, filter, merge, write) in
+## `with phase("load", rows_in=...) as rec:` and set rec["rows_out"] inside it; one JSON line is written when the
+## phase starts and one when it ends (or fails), with wall/CPU time, rows in/out, bytes read/written and peak RSS.
+## A job killed for going over its memory limit leaves a "start" record without an "end", which names the phase.
+##
+## Off unless asked for, so a plain run of a script behaves as before (pipeline.py and benchmark.py turn it on).
+##
+## Environment:
+##   INSTRUMENT=1            write the records (default 0: phase() does nothing)
+##   INSTRUMENT_LOG=path     append the records to this JSONL file (default: stderr)
+##   PROFILE_PHASE=name      profile the phase(s) with this name (or "script:name"), cProfile by default
+##   PROFILE_MODE=sample     ...with a statistical sampler instead (main thread, low overhead, collapsed stacks)
+##   PROFILE_DIR=dir         where the .prof / .stacks files go (default: next to INSTRUMENT_LOG, else the cwd)
+
+import cProfile
+import json
+import os
+import platform
+import resource
+import signal
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# ---------- EDIT THESE ----------
+ENABLED = os.environ.get("INSTRUMENT", "0") == "1"
+LOG_PATH = os.environ.get("INSTRUMENT_LOG")
+PROFILE_PHASE = os.environ.get("PROFILE_PHASE", "")
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "cprofile")   # "cprofile" or "sample"
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR") or (Path(LOG_PATH).parent if LOG_PATH else "."))
+SAMPLE_INTERVAL = 0.005   # seconds of CPU time between samples
+# -------------------------------
+
+SCRIPT = Path(sys.argv[0]).stem if sys.argv and sys.argv[0] else "python"
+_open_phases = []   # records of the phases currently running, outermost first
+
+def proc_status() -> dict:
+    """VmRSS and VmHWM (peak since start or the last reset) in KiB; empty off Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            return {k: int(v.split()[0]) for k, v in (line.split(":", 1) for line in f) if k in ("VmRSS", "VmHWM")}
+    except OSError:
+        return {}
+
+def io_counters() -> dict:
+    """Bytes this process has read and written through any file or pipe (rchar / wchar); empty off Linux."""
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(":", 1) for line in f) if k in ("rchar", "wchar")}
+    except OSError:
+        return {}
+
+def reset_peak_rss() -> bool:
+    """Restart VmHWM from the current RSS (Linux), so the peak seen at a phase's end belongs to that phase."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def path_bytes(paths) -> int:
+    return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+def emit(record: dict):
+    line = json.dumps(record, default=str) + "\n"
+    if LOG_PATH:
+        with open(LOG_PATH, "a") as f:   # opened per record, so every finished phase is on disk if the job is killed
+            f.write(line)
+    else:
+        sys.stderr.write(line)
+        sys.stderr.flush()
+
+# Statistical profiler: a CPU-time timer interrupts the main thread and counts its call stack
+class Sampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_code.co_name} ({Path(frame.f_code.co_filename).name}:{frame.f_lineno})")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self):
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous)
+
+    def dump_stats(self, path):
+        """Collapsed stacks ("frame;frame;frame count"), the input format of flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+def start_profiler(name: str):
+    if name not in PROFILE_PHASE.split(",") and f"{SCRIPT}:{name}" not in PROFILE_PHASE.split(","):
+        return None, None
+    if PROFILE_MODE == "sample" and hasattr(signal, "setitimer"):
+        profiler, suffix = Sampler(), "stacks"
+    else:
+        profiler, suffix = cProfile.Profile(), "prof"   # cProfile sees the calling thread only
+    profiler.enable()
+    return profiler, PROFILE_DIR / f"{SCRIPT}.{name}.{os.getpid()}.{suffix}"
+
+@contextmanager
+def phase(name: str, rows_in: int = None, inputs=(), outputs=(), **fields):
+    """
+    Time one phase of a script and write its JSON records. Yields the end record as a dict: set rows_out, or any
+    other field, on it inside the block. inputs / outputs are file paths whose sizes are recorded as well, since
+    bytes_read / bytes_written only count I/O this process did (0 for memory-mapped reads, and off Linux).
+    """
+    if not ENABLED:
+        yield {}
+        return
+    record = {"script": SCRIPT, "phase": name, "host": platform.node(), "pid": os.getpid(), **fields}
+    if rows_in is not None:
+        record["rows_in"] = rows_in
+    if inputs:
+        record["input_bytes"] = path_bytes(inputs)
+    status = proc_status()
+    emit({**record, "event": "start", "time": time.time(), "rss_mb": round(status.get("VmRSS", 0) / 1024, 1)})
+
+    # the parent's peak so far is kept before the counter restarts for this phase, and handed back at the end
+    parent = _open_phases[-1] if _open_phases else None
+    if parent is not None:
+        parent["_peak_kib"] = max(parent.get("_peak_kib", 0), status.get("VmHWM", 0))
+    per_phase = reset_peak_rss()
+    _open_phases.append(record)
+    io0, wall0, cpu0 = io_counters(), time.perf_counter(), time.process_time()
+    profiler, profile_path = start_profiler(name)
+    try:
+        yield record
+        record["event"] = "end"
+    except BaseException as e:
+        record["event"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(profile_path)
+            record["profile"] = str(profile_path)
+        record["wall_s"] = round(time.perf_counter() - wall0, 3)
+        record["cpu_s"] = round(time.process_time() - cpu0, 3)
+        io1 = io_counters()
+        if io1:
+            record["bytes_read"] = io1["rchar"] - io0["rchar"]
+            record["bytes_written"] = io1["wchar"] - io0["wchar"]
+        if outputs:
+            record["output_bytes"] = path_bytes(outputs)
+
+        _open_phases.pop()
+        status = proc_status()
+        peak_kib = max(status.get("VmHWM", 0), record.pop("_peak_kib", 0))
+        if not status:   # no /proc: the process-wide peak is all there is (KiB on Linux/BSD, bytes on macOS)
+            peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+        record["rss_mb"] = round(status.get("VmRSS", 0) / 1024, 1)
+        record["peak_rss_mb"] = round(peak_kib / 1024, 1)
+        record["peak_rss_scope"] = "phase" if per_phase else "process"
+        if parent is not None:
+            parent["_peak_kib"] = max(parent.get("_peak_kib", 0), peak_kib)
+        emit({**record, "time": time.time()})
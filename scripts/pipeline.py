@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Runs the analysis scripts as a dependency graph. Every stage declares its command, input files and output files.
+Stages depend on the stages that produce their inputs. A stage is rerun only when an output is missing or older
+than one of its inputs or its code: the script itself, plus the sibling modules it imports. Stages whose
+dependencies are done run in parallel, N_JOBS at a time.
+
+Usage:
+  python pipeline.py                       # bring every stage up to date
+  python pipeline.py af_diffs CGC_associated_variants   # only these stages (and whatever they need)
+  python pipeline.py -n                    # list what would run, run nothing
+  python pipeline.py --force get_eQTLs     # rerun a stage even if it looks up to date
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+# ---------- EDIT THESE ----------
+PHD = Path("/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd")
+SCRIPTS = Path(__file__).resolve().parent
+LOG_DIR = PHD / "pipeline_logs"
+N_JOBS = os.cpu_count() or 1
+POPULATIONS = ["AFR", "AMR", "EAS", "EUR", "SAS"]
+GWAS_SETS = ["all_gwas", "cancer_gwas", "immunological_gwas", "neurological_gwas"]
+CLOSEST_POPULATIONS = ["EUR", "EAS"]   # populations with a bedtools-closest cancer table
+# -------------------------------
+
+GWAS = PHD / "NHGRI_EBI_GWAS"
+KGP = PHD / "1KGP_hg38"
+GWAS_1KG = PHD / "gwas_1000_genomes"
+GENCODE = PHD / "preliminary_exploration/gencode"
+SELECTION = PHD / "preliminary_exploration/variant_selection"
+VEP = PHD / "preliminary_exploration/vep"
+GENE_STORE = GENCODE / "gencode_v47_annotation.npz"
+SIMPLE_GTF = GENCODE / "gencode_hg38_v47.gtf.gz"
+KGP_VCFS = sorted(KGP.glob("ALL.chr*.vcf.gz"))   # the per-chromosome 1KGP release files
+KGP_COUNTS = [KGP / f for f in ["pop_count.txt", "unique_pop_count.txt", "af_hist.txt", "af_hist_EUR_EAS.txt"]]
+CLOSEST = {pop: SELECTION / f"{pop}_cancer_closest_genes.bed" for pop in CLOSEST_POPULATIONS}
+CGC_LIST = SELECTION / "CGC_EUR_EAS_overlap_genes.txt"
+
+def python_stage(name, script, inputs, outputs, cwd=SCRIPTS):
+    return {"name": name, "cmd": [sys.executable, str(SCRIPTS / script)], "cwd": cwd,
+            "inputs": inputs, "outputs": outputs, "code": [SCRIPTS / script]}
+
+def shell_stage(name, cmd, inputs, outputs, cwd=PHD):
+    return {"name": name, "cmd": ["bash", "-c", cmd], "cwd": cwd, "inputs": inputs, "outputs": outputs, "code": []}
+
+STAGES = [
+    python_stage("phenotype_modifier", "phenotype_modifier.py",
+                 [GWAS / "gwas_catalog_v1.0-associations_e113_r2025-02-18.tsv"],
+                 [GWAS / f"{s}.bed" for s in GWAS_SETS]),
+    # per-population variants from the 1KGP scan (default MODE / OUTPUT_FORMAT), written next to the release files
+    python_stage("1KGP_population_variants", "1KGP_population_variants.py", KGP_VCFS,
+                 [KGP / f"{pop}_variants.vcf" for pop in POPULATIONS] + KGP_COUNTS, cwd=KGP),
+    *[shell_stage(f"sort_variants_{pop}",
+                  f"sort -k1,1V -k2,2n {pop}_variants.vcf > {pop}_variants_sorted.vcf.tmp "
+                  f"&& mv {pop}_variants_sorted.vcf.tmp {pop}_variants_sorted.vcf",
+                  [KGP / f"{pop}_variants.vcf"], [KGP / f"{pop}_variants_sorted.vcf"], cwd=KGP)
+      for pop in POPULATIONS],
+    # one bedtools stage per population (1000g_gwas_bedtools.sh, split so the populations run side by side)
+    *[shell_stage(f"gwas_1000g_{pop}",
+                  " && ".join(f"bedtools intersect -a {GWAS / s}.bed -b {KGP / pop}_variants_sorted.vcf -wo > {GWAS_1KG / pop}_{s}.bed"
+                              for s in GWAS_SETS),
+                  [GWAS / f"{s}.bed" for s in GWAS_SETS] + [KGP / f"{pop}_variants_sorted.vcf"],
+                  [GWAS_1KG / f"{pop}_{s}.bed" for s in GWAS_SETS])
+      for pop in POPULATIONS],
+    python_stage("gencode_file_modification", "gencode_file_modification.py",
+                 [PHD / "gencode.v47.annotation.gtf.gz"] + [GWAS_1KG / f"{pop}_all_gwas.bed" for pop in POPULATIONS],
+                 [SIMPLE_GTF, GENCODE / "gencode_hg38_v47.gtf", GENE_STORE] + [GENCODE / f"{pop}_gencode.vcf" for pop in POPULATIONS],
+                 cwd=PHD),
+    python_stage("bed_to_vcf", "bed_to_vcf.py",
+                 [GWAS_1KG / f"{pop}_all_gwas.bed" for pop in POPULATIONS],
+                 [VEP / f"{pop}_all_gwas.vcf" for pop in POPULATIONS]),
+    python_stage("get_eQTLs", "get_eQTLs.py",
+                 [PHD / "GTEx_hg38_v10"] + [GWAS_1KG / f"{pop}_all_gwas.bed" for pop in POPULATIONS],
+                 [PHD / "all_GTEx_hg38_v10.bed"] + [PHD / f"{pop}_all_GTEx.bed" for pop in POPULATIONS],
+                 cwd=PHD),
+    # closest GENCODE feature per cancer variant (intersect_population_variants_with_genes.sh), sorting the upstream
+    # outputs on the fly; written to a temporary file first so a failed run never leaves a complete-looking table
+    *[shell_stage(f"closest_{pop}",
+                  f"bedtools closest -a <(sort -k1,1V -k2,2n {GWAS_1KG / pop}_cancer_gwas.bed) "
+                  f"-b <(zcat {SIMPLE_GTF} | sort -k1,1V -k2,2n) -d > {CLOSEST[pop].name}.tmp "
+                  f"&& mv {CLOSEST[pop].name}.tmp {CLOSEST[pop].name}",
+                  [GWAS_1KG / f"{pop}_cancer_gwas.bed", SIMPLE_GTF], [CLOSEST[pop]], cwd=SELECTION)
+      for pop in CLOSEST_POPULATIONS],
+    python_stage("CGC_associated_variants", "CGC_associated_variants.py",
+                 [CLOSEST["EUR"], CLOSEST["EAS"], CGC_LIST, GENE_STORE],
+                 [SELECTION / f for f in ["unique_EUR_by_phenotype.tsv", "unique_EAS_by_phenotype.tsv",
+                                          "triplet_overlap.tsv", "triplet_overlap_by_cancertype.tsv"]]),
+    python_stage("unique_cancer_variants", "unique_cancer_variants.py",
+                 [CLOSEST["EUR"], CLOSEST["EAS"], GENE_STORE],
+                 [SELECTION / f for f in ["unique_EUR_by_phenotype_noCGC.tsv", "unique_EAS_by_phenotype_noCGC.tsv",
+                                          "gene_cancer_pairs_popSpecific_both.tsv"]]),
+    python_stage("af_diffs", "af_diffs.py",
+                 list(CLOSEST.values()) + [CGC_LIST, GENE_STORE],
+                 [SELECTION / f for f in ["both_pops_same_gene_pheno_AFdiff.tsv", "both_pops_same_gene_pheno_AFdiff_noCGC.tsv",
+                                          "all_pop_pairs_same_gene_pheno_AFdiff.tsv", "all_pop_pairs_AFdiff_index.npz"]]),
+]
+
+# Function to find the sibling modules a script imports, recursively (their edits make the stage stale too)
+def local_imports(script: Path, seen=None) -> set:
+    seen = set() if seen is None else seen
+    for node in ast.walk(ast.parse(script.read_text())):
+        names = [a.name for a in node.names] if isinstance(node, ast.Import) else \
+                [node.module] if isinstance(node, ast.ImportFrom) and node.module else []
+        for name in names:
+            module = script.parent / f"{name.split('.')[0]}.py"
+            if module.exists() and module not in seen:
+                seen.add(module)
+                local_imports(module, seen)
+    return seen
+
+def mtime(path: Path) -> float:
+    """Newest modification time under path (a directory counts as its newest file)."""
+    if path.is_dir():
+        return max([p.stat().st_mtime for p in path.rglob("*") if p.is_file()] + [path.stat().st_mtime])
+    return path.stat().st_mtime
+
+def stamp_path(stage) -> Path:
+    return LOG_DIR / f"{stage['name']}.done"
+
+# Function to give the reason a stage must run, or None if its outputs are up to date
+def stale_reason(stage) -> str:
+    missing = [p for p in stage["outputs"] if not p.exists()]
+    if missing:
+        return f"missing {missing[0].name}"
+    # a script may leave an output it found current untouched (gencode_file_modification.py and its store),
+    # so the last successful run also counts as the time the outputs were brought up to date
+    stamp = stamp_path(stage)
+    oldest = max(min(mtime(p) for p in stage["outputs"]), stamp.stat().st_mtime if stamp.exists() else 0)
+    for p in stage["inputs"] + stage["code"]:
+        if p.exists() and mtime(p) > oldest:
+            return f"{p.name} changed"
+    return None
+
+def build_graph(stages):
+    """stage name -> names of the stages producing its inputs."""
+    producer = {}
+    for stage in stages:
+        for p in stage["outputs"]:
+            if p in producer:
+                raise ValueError(f"{p} is an output of both {producer[p]} and {stage['name']}")
+            producer[p] = stage["name"]
+    return {s["name"]: sorted({producer[p] for p in s["inputs"] if p in producer} - {s["name"]}) for s in stages}
+
+def upstream(names, deps) -> set:
+    todo, out = list(names), set()
+    while todo:
+        name = todo.pop()
+        if name not in out:
+            out.add(name)
+            todo.extend(deps[name])
+    return out
+
+def run_stage(stage):
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    log = LOG_DIR / f"{stage['name']}.log"
+    metrics = LOG_DIR / f"{stage['name']}.metrics.jsonl"   # per-phase records from instrument.py
+    metrics.unlink(missing_ok=True)
+    t0 = time.time()
+    with open(log, "w") as f:
+        rc = subprocess.run(stage["cmd"], cwd=stage["cwd"], stdout=f, stderr=subprocess.STDOUT,
+                            env=dict(os.environ, INSTRUMENT="1", INSTRUMENT_LOG=str(metrics))).returncode
+    if rc == 0:
+        stamp_path(stage).touch()
+    return rc, time.time() - t0, log
+
+def run(stages, targets=None, force=(), dry_run=False, n_jobs=N_JOBS) -> bool:
+    """Brings targets (default: every stage) up to date; returns False if a stage failed."""
+    by_name = {s["name"]: s for s in stages}
+    deps = build_graph(stages)
+    unknown = [t for t in list(targets or []) + list(force) if t not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(unknown)}")
+    selected = upstream(list(targets) + list(force), deps) if targets else set(by_name)
+    for stage in stages:
+        stage["code"] = sorted(set(stage["code"]) | {m for c in stage["code"] if c.suffix == ".py" for m in local_imports(c)})
+
+    done, failed, ran = set(), set(), set()
+    pending = [s["name"] for s in stages if s["name"] in selected]
+    running = {}
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        while pending or running:
+            progress = False
+            for name in list(pending):
+                if not all(d in done or d in failed or d not in selected for d in deps[name]):
+                    continue
+                pending.remove(name)
+                progress = True
+                stage = by_name[name]
+                if any(d in failed for d in deps[name]):
+                    print(f"[WARN] {name}: skipped, an upstream stage failed")
+                    failed.add(name)
+                    continue
+                # in a dry run nothing is rewritten, so a stage downstream of one that would run is stale as well
+                reason = ("forced" if name in force else
+                          next((f"{d} would rerun" for d in deps[name] if dry_run and d in ran), None) or stale_reason(stage))
+                if reason is None:
+                    print(f"[OK] {name}: up to date")
+                    done.add(name)
+                    continue
+                ran.add(name)
+                if dry_run:
+                    print(f"[INFO] {name}: would run ({reason})")
+                    done.add(name)
+                    continue
+                missing = [p for p in stage["inputs"] if not p.exists()]
+                if missing:
+                    print(f"[ERROR] {name}: missing input {missing[0]}")
+                    failed.add(name)
+                    continue
+                print(f"[INFO] {name}: running ({reason})")
+                running[pool.submit(run_stage, stage)] = name
+            if not running:
+                if pending and not progress:
+                    raise ValueError(f"Dependency cycle among: {', '.join(pending)}")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                rc, seconds, log = future.result()
+                if rc == 0:
+                    print(f"[OK] {name}: finished in {seconds:.1f}s")
+                    done.add(name)
+                else:
+                    print(f"[ERROR] {name}: exit code {rc} after {seconds:.1f}s, see {log}")
+                    failed.add(name)
+    return not failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental runner for the analysis scripts")
+    parser.add_argument("targets", nargs="*", help="stages to bring up to date (default: all)")
+    parser.add_argument("-n", "--dry-run", action="store_true", help="list the stages that would run")
+    parser.add_argument("--force", nargs="+", default=[], metavar="STAGE", help="rerun these stages regardless")
+    parser.add_argument("-j", "--jobs", type=int, default=N_JOBS, help="stages run at once")
+    parser.add_argument("--list", action="store_true", help="print the stages and their dependencies")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, d in build_graph(STAGES).items():
+            print(f"{name}\t<- {', '.join(d) or '-'}")
+        return
+    sys.exit(0 if run(STAGES, args.targets, args.force, args.dry_run, args.jobs) else 1)
+
+if __name__ == "__main__":
+    main()
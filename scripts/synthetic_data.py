@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Writes a small, self-consistent copy of the project's input tree with synthetic data, laid out like the cluster
+directory (NHGRI_EBI_GWAS/, 1KGP_hg38/, GTEx_hg38_v10/, gwas_1000_genomes/, preliminary_exploration/...),
+so every stage can be run and timed offline (see benchmark.py).
+
+All files share one pool of variants and one set of genes, so the joins between stages find matches:
+  - 1KGP-style VCFs (one BGZF file and .tbi per chromosome) with AC/AF and the five {POP}_AF INFO keys
+  - a GENCODE-like GTF (gene / transcript / exon lines with gene_id, gene_type, gene_name attributes)
+  - GWAS catalog associations (38 columns, incl. missing CHR_ID rows and multi-SNP rows) and the ancestry table
+  - GTEx *.v10.eQTLs.signif_pairs.parquet files, one per tissue
+  - {pop}_all_gwas.bed / {pop}_cancer_gwas.bed as written by bedtools intersect -wo (17 columns)
+  - {pop}_cancer_closest_genes.bed as written by bedtools closest -d (24 columns), the CGC gene list and COSMIC CGC table
+
+Usage:
+  python synthetic_data.py OUT_DIR [--scale 20000] [--seed 0]
+"""
+
+import argparse
+import csv
+import gzip
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bgzf import TabixVcfWriter
+
+POPULATIONS = ["EAS", "AMR", "AFR", "EUR", "SAS"]
+CHROMS = [str(c) for c in range(1, 23)] + ["X"]
+BASES = np.array(list("ACGT"))
+TISSUES = ["Whole_Blood", "Lung", "Breast_Mammary_Tissue", "Colon_Transverse"]
+GENE_TYPES = ["protein_coding", "lncRNA", "processed_pseudogene", "miRNA"]
+PHENOTYPES = {
+    "cancer": ["Breast cancer", "Prostate cancer", "Colorectal cancer", "Lung adenocarcinoma", "Gastric cancer",
+               "Melanoma", "Renal cell carcinoma", "Pancreatic cancer", "Thyroid cancer", "Cancer (excluded)",
+               "Non-cancer illness code, self-reported: asthma"],
+    "neurological": ["Schizophrenia", "Bipolar disorder", "Major depressive disorder", "Intelligence", "Autism"],
+    "immunological": ["Asthma", "Rheumatoid arthritis", "Lymphocyte count", "Neutrophil count", "COVID-19"],
+    "other": ["Height", "Body mass index", "Type 2 diabetes", "LDL cholesterol", "Systolic blood pressure"],
+}
+CATALOG_COLUMNS = [
+    "DATE ADDED TO CATALOG", "PUBMEDID", "FIRST AUTHOR", "DATE", "JOURNAL", "LINK", "STUDY", "DISEASE/TRAIT",
+    "INITIAL SAMPLE SIZE", "REPLICATION SAMPLE SIZE", "REGION", "CHR_ID", "CHR_POS", "REPORTED GENE(S)", "MAPPED_GENE",
+    "UPSTREAM_GENE_ID", "DOWNSTREAM_GENE_ID", "SNP_GENE_IDS", "UPSTREAM_GENE_DISTANCE", "DOWNSTREAM_GENE_DISTANCE",
+    "STRONGEST SNP-RISK ALLELE", "SNPS", "MERGED", "SNP_ID_CURRENT", "CONTEXT", "INTERGENIC", "RISK ALLELE FREQUENCY",
+    "P-VALUE", "PVALUE_MLOG", "P-VALUE (TEXT)", "OR or BETA", "95% CI (TEXT)", "PLATFORM [SNPS PASSING QC]", "CNV",
+    "MAPPED_TRAIT", "MAPPED_TRAIT_URI", "STUDY ACCESSION", "GENOTYPING TECHNOLOGY",
+]
+NEAR_GENE = 20_000   # cancer variants are drawn within this distance of a gene, so most pass the scripts' MAX_DIST (10 kb)
+ANCESTRIES = ["European", "East Asian", "African", "South Asian", "Hispanic or Latin American", "African American or Afro-Caribbean",
+              "Asian unspecified", "NR", "European, East Asian", "European, African, South Asian"]
+
+def make_variants(n: int, rng) -> pd.DataFrame:
+    """The shared variant pool: sorted coordinates, rsIDs, alleles and one AF per population."""
+    chrom = rng.choice(CHROMS, size=n, p=np.r_[np.linspace(2, 1, 22), 1.2] / np.r_[np.linspace(2, 1, 22), 1.2].sum())
+    pos = rng.integers(10_000, 150_000_000, size=n)
+    v = pd.DataFrame({"chrom": chrom, "pos": pos})
+    v["chrom_rank"] = v["chrom"].map({c: i for i, c in enumerate(CHROMS)})
+    v = v.sort_values(["chrom_rank", "pos"]).drop_duplicates(["chrom", "pos"]).reset_index(drop=True)
+    n = len(v)
+    v["rsid"] = np.where(rng.random(n) < 0.9, "rs" + pd.Series(rng.permutation(n) + 1000).astype(str), ".")
+    ref = rng.integers(0, 4, n)
+    v["ref"] = BASES[ref]
+    v["alt"] = BASES[(ref + rng.integers(1, 4, n)) % 4]
+    base_af = rng.beta(0.4, 1.2, n)
+    for pop in POPULATIONS:
+        drift = rng.normal(0, 0.4, n) * (rng.random(n) < 0.3)  # a minority of variants differ strongly between populations
+        v[f"{pop}_AF"] = np.round(np.clip(base_af + drift, 0, 1), 4)
+    return v.drop(columns="chrom_rank")
+
+def make_genes(n_genes: int, rng, v: pd.DataFrame = None) -> pd.DataFrame:
+    """GTF rows (GENCODE layout: chr-prefixed chromosomes, 1-based coordinates): a gene, one transcript and 1-4 exons per gene.
+    With a variant pool v, every gene is placed over a random variant of the pool, so genes and variants share chromosomes."""
+    rows = []
+    length = rng.integers(2_000, 200_000, size=n_genes)
+    if v is None:
+        chrom = rng.choice(CHROMS, size=n_genes)
+        start = rng.integers(10_000, 149_000_000, size=n_genes)
+    else:
+        anchor = v.iloc[rng.integers(0, len(v), n_genes)]
+        chrom = anchor["chrom"].to_numpy()
+        start = np.maximum(anchor["pos"].to_numpy() - rng.integers(0, length), 1)
+    strand = rng.choice(["+", "-"], size=n_genes)
+    gtype = rng.choice(GENE_TYPES, size=n_genes, p=[0.5, 0.3, 0.15, 0.05])
+    for g in range(n_genes):
+        gene_id = f"ENSG{g + 1:011d}.{rng.integers(1, 20)}"
+        name = f"GENE{g + 1}"
+        attrs = f'gene_id "{gene_id}"; gene_type "{gtype[g]}"; gene_name "{name}"; level 2;'
+        s, e = int(start[g]), int(start[g] + length[g])
+        rows.append((chrom[g], s, e, strand[g], "gene", attrs))
+        rows.append((chrom[g], s, e, strand[g], "transcript", attrs.replace("level 2;", f'transcript_id "ENST{g + 1:011d}.1"; level 2;')))
+        cuts = np.sort(rng.choice(np.arange(s + 1, e), size=2 * rng.integers(1, 5), replace=False))
+        for k, (es, ee) in enumerate(cuts.reshape(-1, 2)):
+            rows.append((chrom[g], int(es), int(ee), strand[g], "exon", attrs.replace("level 2;", f'exon_number {k + 1}; level 2;')))
+    genes = pd.DataFrame(rows, columns=["chrom", "start", "end", "strand", "feature", "attrs"])
+    genes["chrom"] = "chr" + genes["chrom"]
+    rank = genes["chrom"].str[3:].map({c: i for i, c in enumerate(CHROMS)})
+    return genes.assign(_rank=rank).sort_values(["_rank", "start"], kind="stable").drop(columns="_rank").reset_index(drop=True)
+
+def write_text(df: pd.DataFrame, path: Path, header=False, gz=False, preamble=""):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with (gzip.open(path, "wt", compresslevel=1) if gz else open(path, "w")) as f:
+        f.write(preamble)
+        df.to_csv(f, sep="\t", index=False, header=header, quoting=csv.QUOTE_NONE, quotechar="\x00")
+
+# Function to write one bgzipped, tabix-indexed VCF per chromosome with the 1KGP INFO layout, so the scan, the
+# region queries (BgzfReader + linear index) and the vcf.gz outputs of 1KGP_population_variants.py all run on it
+def write_1kgp_vcfs(out_dir: Path, v: pd.DataFrame, rng):
+    ac = (v[[f"{p}_AF" for p in POPULATIONS]].mean(axis=1) * 5008).round().astype(int)
+    info = "AC=" + ac.astype(str) + ";AN=5008;AF=" + (ac / 5008).round(4).astype(str)
+    for pop in POPULATIONS:
+        info = info + f";{pop}_AF=" + v[f"{pop}_AF"].astype(str)
+    info = info.where(rng.random(len(v)) > 0.01, info.str.replace(";SAS_AF=", ";SAS_AF=.,", regex=False))  # a few missing/multi-value AFs
+    gt = pd.Series(rng.choice(["0|0", "0|1", "1|0", "1|1"], size=len(v)))
+    vcf = pd.DataFrame({"#CHROM": v["chrom"], "POS": v["pos"], "ID": v["rsid"], "REF": v["ref"], "ALT": v["alt"],
+                        "QUAL": ".", "FILTER": "PASS", "INFO": info, "FORMAT": "GT", "HG00096": gt, "HG00097": gt.iloc[::-1].to_numpy()})
+    preamble = "##fileformat=VCFv4.2\n" + "".join(f'##INFO=<ID={p}_AF,Number=A,Type=Float,Description="{p} AF">\n' for p in POPULATIONS)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for chrom, part in vcf.groupby("#CHROM", sort=False):
+        path = out_dir / f"ALL.chr{chrom}.shapeit2_integrated_snvindels_v2a_27022019.GRCh38.phased.vcf.gz"
+        with TabixVcfWriter(str(path), level=1) as f:
+            f.write(preamble + "\t".join(vcf.columns) + "\n")
+            begs = part["POS"].to_numpy() - 1
+            f.write_records(part.to_csv(sep="\t", index=False, header=False, quoting=csv.QUOTE_NONE, quotechar="\x00"),
+                            part["#CHROM"].to_numpy(), begs, begs + part["REF"].str.len().to_numpy())
+
+def write_gtf(path: Path, genes: pd.DataFrame):
+    gtf = pd.DataFrame({"seqname": genes["chrom"], "source": "HAVANA", "feature": genes["feature"], "start": genes["start"],
+                        "end": genes["end"], "score": ".", "strand": genes["strand"], "frame": ".", "attrs": genes["attrs"]})
+    write_text(gtf, path, gz=True, preamble="##description: synthetic GENCODE-like annotation\n##provider: GENCODE\n##format: gtf\n")
+
+def phenotype_pool(rng, n):
+    groups = list(PHENOTYPES)
+    group = rng.choice(groups, size=n, p=[0.35, 0.2, 0.2, 0.25])
+    return np.array([PHENOTYPES[g][rng.integers(len(PHENOTYPES[g]))] for g in group])
+
+# Function to write the GWAS catalog associations and ancestry tables (column layout of the e113 release)
+def write_gwas_catalog(out_dir: Path, v: pd.DataFrame, n_assoc: int, rng):
+    idx = rng.integers(0, len(v), n_assoc)
+    a = v.iloc[idx].reset_index(drop=True)
+    cat = pd.DataFrame("x", index=range(n_assoc), columns=CATALOG_COLUMNS)
+    n_studies = max(n_assoc // 20, 1)
+    study = rng.integers(0, n_studies, n_assoc)
+    cat["PUBMEDID"] = (30_000_000 + study).astype(str)
+    cat["STUDY ACCESSION"] = "GCST" + pd.Series(study).astype(str).str.zfill(6)
+    cat["DISEASE/TRAIT"] = phenotype_pool(rng, n_assoc)
+    cat["CHR_ID"] = a["chrom"]
+    cat["CHR_POS"] = a["pos"].astype(str)
+    cat["SNPS"] = a["rsid"].where(a["rsid"] != ".", "chr" + a["chrom"] + ":" + a["pos"].astype(str))
+    no_chrom = (rng.random(n_assoc) < 0.05) | (a["rsid"] == ".").to_numpy()
+    cat.loc[no_chrom, ["CHR_ID", "CHR_POS"]] = ""
+    cat.loc[no_chrom, "SNPS"] = "chr" + a["chrom"] + ":" + a["pos"].astype(str) + ":" + a["ref"] + ":" + a["alt"]
+    multi = ~no_chrom & (rng.random(n_assoc) < 0.02)
+    cat.loc[multi, "CHR_ID"] = a["chrom"] + ";" + a["chrom"]
+    cat.loc[multi, "SNPS"] = a["rsid"] + "; rs1"
+    cat["RISK ALLELE FREQUENCY"] = np.where(rng.random(n_assoc) < 0.7, np.round(rng.random(n_assoc), 3).astype(str), "NR")
+    cat["P-VALUE"] = [f"{m}E-{e}" for m, e in zip(rng.integers(1, 10, n_assoc), rng.integers(6, 40, n_assoc))]
+    cat["OR or BETA"] = np.where(rng.random(n_assoc) < 0.6, np.round(rng.lognormal(0, 0.2, n_assoc), 3).astype(str), "")
+    write_text(cat, out_dir / "gwas_catalog_v1.0-associations_e113_r2025-02-18.tsv", header=True)
+
+    anc = pd.DataFrame({
+        "STUDY ACCESSION": "GCST" + pd.Series(np.repeat(np.arange(n_studies), 2)).astype(str).str.zfill(6),
+        "PUBMEDID": (30_000_000 + np.repeat(np.arange(n_studies), 2)).astype(str),
+        "FIRST AUTHOR": "x", "DATE": "2024-01-01", "INITIAL SAMPLE DESCRIPTION": "x",
+        "STAGE": np.tile(["initial", "replication"], n_studies),
+        "NUMBER OF INDIVIDUALS": rng.integers(500, 500_000, 2 * n_studies),
+        "BROAD ANCESTRAL CATEGORY": rng.choice(ANCESTRIES, 2 * n_studies),
+        "COUNTRY OF ORIGIN": "NR", "COUNTRY OF RECRUITMENT": "NR", "ADDITIONAL ANCESTRY DESCRIPTION": "",
+    })
+    write_text(anc, out_dir / "gwas_catalog-ancestry_r2025-02-18.tsv", header=True)
+
+# Function to write GTEx significant variant-gene pairs, one parquet file per tissue
+def write_gtex(out_dir: Path, v: pd.DataFrame, genes: pd.DataFrame, pairs_per_tissue: int, rng):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    gene_ids = genes.loc[genes["feature"] == "gene", "attrs"].str.extract(r'gene_id "([^"]+)"', expand=False).to_numpy()
+    for tissue in TISSUES:
+        a = v.iloc[rng.integers(0, len(v), pairs_per_tissue)]
+        table = pa.table({
+            "phenotype_id": rng.choice(gene_ids, pairs_per_tissue),
+            # get_eQTLs.py uses the ID's chromosome and position as the BED chrom and start, so the IDs carry the GWAS
+            # BEDs' naming (no "chr") and start (pos - 1) for its overlap step to have hits to write
+            "variant_id": (a["chrom"] + "_" + (a["pos"] - 1).astype(str) + "_" + a["ref"] + "_" + a["alt"] + "_b38").to_numpy(),
+            "tss_distance": rng.integers(-1_000_000, 1_000_000, pairs_per_tissue),
+            "af": rng.random(pairs_per_tissue),
+            "ma_samples": rng.integers(10, 500, pairs_per_tissue),
+            "ma_count": rng.integers(10, 600, pairs_per_tissue),
+            "pval_nominal": rng.random(pairs_per_tissue) * 1e-5,
+            "slope": rng.normal(0, 0.5, pairs_per_tissue),
+            "slope_se": rng.random(pairs_per_tissue) * 0.1,
+        })
+        pq.write_table(table, out_dir / f"{tissue}.v10.eQTLs.signif_pairs.parquet")
+
+def gwas_1000g_rows(v: pd.DataFrame, pop: str, n: int, phenotypes, rng) -> pd.DataFrame:
+    """17 columns of bedtools intersect -wo between a phenotype_modifier.py BED (9) and a {pop}_variants file (7) + overlap."""
+    present = np.flatnonzero(v[f"{pop}_AF"].to_numpy() > 0)
+    a = v.iloc[np.sort(rng.choice(present, size=min(n, len(present)), replace=True))].reset_index(drop=True)
+    start = a["pos"] - 1
+    return pd.DataFrame({
+        "CHR": a["chrom"], "start_pos": start, "end_pos": start + 1, "RSID": a["rsid"].replace(".", ""),
+        "Phenotype": rng.choice(phenotypes, len(a)), "risk_AF": np.round(rng.random(len(a)), 3),
+        "p_value": [f"{m}E-{e}" for m, e in zip(rng.integers(1, 10, len(a)), rng.integers(6, 40, len(a)))],
+        "OR": np.round(rng.lognormal(0, 0.2, len(a)), 3), "PMID": rng.integers(30_000_000, 30_100_000, len(a)),
+        "v_CHR": a["chrom"], "v_start_pos": start, "v_end_pos": start + 1, "v_rsid": a["rsid"],
+        "REF": a["ref"], "ALT": a["alt"], "AF": a[f"{pop}_AF"], "overlap": 1,
+    })
+
+# Function to find each variant's closest "gene" row (on the simplified, chr-less chromosome names) and its bedtools distance
+def closest_genes(v: pd.DataFrame, genes: pd.DataFrame):
+    gene_rows = genes[genes["feature"] == "gene"].assign(chrom=lambda d: d["chrom"].str[3:])
+    hit = np.full(len(v), -1, dtype=np.int64)          # index into gene_rows, -1 if the chromosome has no genes
+    dist = np.full(len(v), np.iinfo(np.int64).max, dtype=np.int64)
+    for chrom, idx in v.groupby("chrom", sort=False).indices.items():
+        g = np.flatnonzero(gene_rows["chrom"].to_numpy() == chrom)
+        if len(g) == 0:
+            continue
+        pos = v["pos"].to_numpy()[idx][:, None]
+        # variant BED interval is [pos - 1, pos); genes are 1-based closed [start, end]: 0 inside, else the gap
+        d = np.maximum(0, np.maximum(gene_rows["start"].to_numpy()[g] - pos, pos - gene_rows["end"].to_numpy()[g]))
+        best = d.argmin(axis=1)
+        hit[idx], dist[idx] = g[best], d[np.arange(len(idx)), best]
+    return gene_rows, hit, dist
+
+# Function to write the {pop}_cancer_closest_genes.bed tables: the 17 GWAS x 1KGP columns, the closest simplified-GTF row, the distance
+def write_closest_tables(out_dir: Path, v: pd.DataFrame, genes: pd.DataFrame, n_per_pop: int, rng):
+    gene_rows, hit, dist = closest_genes(v, genes)
+    v = v.assign(_hit=hit, _dist=dist)
+    # one shared pool of cancer variants near genes, so populations overlap on (variant, gene, phenotype)
+    near = v[(v["_hit"] >= 0) & (v["_dist"] <= NEAR_GENE)].reset_index(drop=True)
+    # few variants lie near genes, so each is reused (as GWAS variants are, for several phenotypes) to fill the tables
+    reused = near.iloc[np.sort(rng.integers(0, len(near), 3 * n_per_pop))].reset_index(drop=True)
+    shared = gwas_1000g_rows(reused, "EUR", 3 * n_per_pop, PHENOTYPES["cancer"], rng)
+    closest = near.set_index(["chrom", "pos"])[["_hit", "_dist"]]
+    for pop in POPULATIONS:
+        rows = shared.iloc[np.sort(rng.choice(len(shared), min(n_per_pop, len(shared)), replace=False))].reset_index(drop=True)
+        key = pd.MultiIndex.from_arrays([rows["CHR"], rows["end_pos"]])
+        rows["AF"] = v.set_index(["chrom", "pos"])[f"{pop}_AF"].reindex(key).to_numpy()
+        found = closest.reindex(key)
+        g = gene_rows.iloc[found["_hit"].to_numpy()]
+        gtf = pd.DataFrame({"g_chr": g["chrom"].to_numpy(), "g_start": g["start"].to_numpy(), "g_end": g["end"].to_numpy(),
+                            "g_strand": g["strand"].to_numpy(), "g_feature": g["feature"].to_numpy(),
+                            "g_attrs": g["attrs"].to_numpy()}, index=rows.index)
+        write_text(pd.concat([rows, gtf, pd.Series(found["_dist"].to_numpy(), index=rows.index, name="dist")], axis=1),
+                   out_dir / f"{pop}_cancer_closest_genes.bed")
+
+    names = genes["attrs"].str.extract(r'gene_name "([^"]+)"', expand=False).unique()
+    cgc = pd.DataFrame({"GeneSymbol": rng.choice(names, size=max(len(names) // 4, 1), replace=False)})
+    write_text(cgc, out_dir / "CGC_EUR_EAS_overlap_genes.txt", header=True)
+    gene_rows = genes[genes["feature"] == "gene"].assign(name=lambda d: d["attrs"].str.extract(r'gene_name "([^"]+)"', expand=False))
+    cosmic = pd.DataFrame({"GENE_SYMBOL": gene_rows["name"].to_numpy(), "NAME": "x",
+                           "Genome Location": (gene_rows["chrom"].str[3:] + ":" + gene_rows["start"].astype(str) + "-" + gene_rows["end"].astype(str)).to_numpy(),
+                           "Tier": rng.choice(["1", "2"], len(gene_rows))})
+    write_text(cosmic, out_dir / "Cosmic_CGC.tsv", header=True)
+
+def generate(root: Path, scale: int = 20_000, seed: int = 0) -> dict:
+    """Writes the synthetic tree under root; scale is the number of variants in the shared pool. Returns the row counts."""
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    v = make_variants(scale, rng)
+    genes = make_genes(max(scale // 50, 100), rng, v)
+
+    write_1kgp_vcfs(root / "1KGP_hg38", v, rng)
+    write_gtf(root / "gencode.v47.annotation.gtf.gz", genes)
+    write_gwas_catalog(root / "NHGRI_EBI_GWAS", v, scale // 2, rng)
+    write_gtex(root / "GTEx_hg38_v10", v, genes, scale, rng)
+    all_phenotypes = sum(PHENOTYPES.values(), [])
+    for pop in POPULATIONS:
+        rows = gwas_1000g_rows(v, pop, scale // 2, all_phenotypes, rng)
+        write_text(rows, root / "gwas_1000_genomes" / f"{pop}_all_gwas.bed")
+        write_text(rows[rows["Phenotype"].isin(PHENOTYPES["cancer"])], root / "gwas_1000_genomes" / f"{pop}_cancer_gwas.bed")
+    write_closest_tables(root / "preliminary_exploration" / "variant_selection", v, genes, scale // 10, rng)
+    for d in ["gencode", "vep", "GTEx_eQTLs"]:
+        (root / "preliminary_exploration" / d).mkdir(parents=True, exist_ok=True)
+    return {"variants": len(v), "gtf_rows": len(genes), "catalog_rows": scale // 2, "gtex_pairs": scale * len(TISSUES)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic inputs for every pipeline stage")
+    parser.add_argument("out_dir", type=Path)
+    parser.add_argument("--scale", type=int, default=20_000, help="variants in the shared pool (other tables scale with it)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    counts = generate(args.out_dir, args.scale, args.seed)
+    print(f"[OK] Wrote synthetic inputs to {args.out_dir}: " + ", ".join(f"{k}={n}" for k, n in counts.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+## On-disk cache of parsed input tables (Parquet), so re-running a script does not re-parse the same text files.
+## An entry is keyed on the input's path, size and modification time (or its content hash), the parser and the
+## parser's version and arguments; a changed input or parser simply misses. Least recently used entries are
+## evicted once the cache is over its size budget. Off unless TABLE_CACHE=1 is set; the cache lives in the PHD
+## scratch tree rather than the quota-limited home directory. Meant for the large text inputs (GWAS catalog, closest
+## tables); small files such as the CGC gene list are parsed directly.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+
+# ---------- EDIT THESE ----------
+CACHE_DIR = Path(os.environ.get("TABLE_CACHE_DIR", "/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/table_cache"))
+CACHE_MAX_BYTES = 4 * 1024**3    # evict least recently used entries above this total
+CACHE_ENABLED = os.environ.get("TABLE_CACHE", "0") == "1"
+HASH_CONTENT = False             # True: key on a SHA-1 of the file contents instead of size + mtime
+# -------------------------------
+
+def file_fingerprint(path: Path) -> dict:
+    path = Path(path).resolve()
+    st = path.stat()
+    if HASH_CONTENT:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return {"path": str(path), "sha1": h.hexdigest()}
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def entry_path(path: Path, parser, version, kwargs: dict, cache_dir: Path = None) -> Path:
+    """<input path hash>-<full key hash>.parquet, so all entries parsed from one input share a prefix."""
+    key = {"input": file_fingerprint(path), "parser": f"{parser.__module__}.{parser.__qualname__}",
+           "version": version, "kwargs": {k: repr(v) for k, v in sorted(kwargs.items())}}
+    prefix = hashlib.sha1(key["input"]["path"].encode()).hexdigest()[:16]
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:24]
+    return Path(cache_dir or CACHE_DIR) / f"{prefix}-{digest}.parquet"
+
+def evict(cache_dir: Path = None, max_bytes: int = None):
+    """Delete least recently used entries (by mtime, refreshed on every hit) until the cache fits max_bytes."""
+    cache_dir = Path(cache_dir or CACHE_DIR)
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = sorted((p.stat().st_mtime, p.stat().st_size, p) for p in cache_dir.glob("*.parquet"))
+    total = sum(size for _, size, _ in entries)
+    for _, size, p in entries:
+        if total <= max_bytes:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+
+def cached_table(path: Path, parser, version: int = 1, cache_dir: Path = None, **kwargs) -> pd.DataFrame:
+    """parser(path, **kwargs), or the DataFrame it returned on an earlier run for the same input, parser version and
+    arguments. Bump version whenever the parser's output changes."""
+    if not CACHE_ENABLED:
+        return parser(path, **kwargs)
+    entry = entry_path(path, parser, version, kwargs, cache_dir)
+    if entry.exists():
+        try:
+            df = pd.read_parquet(entry)
+            os.utime(entry)  # mark as recently used
+            return df
+        except (OSError, pa.ArrowException) as e:
+            print(f"[WARN] Unreadable cache entry {entry.name} ({e}); re-parsing {path}")
+
+    df = parser(path, **kwargs)
+    tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(tmp, index=True)
+        os.replace(tmp, entry)  # readers never see a half-written entry
+        evict(entry.parent)
+    except (OSError, pa.ArrowException, ValueError, TypeError) as e:
+        tmp.unlink(missing_ok=True)
+        print(f"[WARN] Could not cache {path} ({e})")
+    return df
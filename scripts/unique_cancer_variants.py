@@ -1,8 +1,11 @@
 # Does the same thing as the CGC_associated_variants..py script, but does not limit the variants to those found in genes on the CGC gene list
 
-import re
 import pandas as pd
 from pathlib import Path
+from cancer_types import map_cancer_types
+from closest_tables import GTF_FIELDS, read_closest_table
+from gencode_store import GENCODE_VERSION, gene_names_for_gtf_columns, load_gene_store
+from variant_keys import variant_keys, variant_labels
 
 # ---------- EDIT THESE ----------
 BASE = Path("/exports/cmvm/eddie/sbms/groups/young-lab/caitlin/phd/preliminary_exploration/variant_selection")
@@ -12,75 +15,33 @@ OUTDIR   = BASE
 MAX_DIST = 10000   # set to None to skip distance filtering
 # -------------------------------
 
-IDX = {
-    "chr": 0, "start": 1, "end": 2, "rsid": 3, "phenotype": 4,
-    "gtf_attrs": 22, "dist": 23
-}
-
-gene_pat = re.compile(r'gene_name\s+"([^"]+)"')
-
-def map_cancer_type(phenotype_raw: str) -> str:
-    if not isinstance(phenotype_raw, str):
-        return "Other/General"
-    p = phenotype_raw.lower()
-    if "prostate" in p: return "Prostate"
-    if "breast" in p: return "Breast"
-    if any(k in p for k in ["colorectal","colon","rectal","rectum","crc"]): return "Colorectal"
-    if any(k in p for k in ["ovarian","ovary"]): return "Ovarian"
-    if any(k in p for k in ["nsclc","non-small cell lung","small-cell lung","sclc","lung","bronchus"]): return "Lung"
-    if any(k in p for k in ["skin","keratinocyte","non-melanoma","melanoma"]): return "Skin"
-    if any(k in p for k in ["gastric","stomach","cardia"]): return "Gastric"
-    if "pancrea" in p: return "Pancreatic"
-    if any(k in p for k in ["cervical","cervix"]): return "Cervical"
-    if "endometrial" in p: return "Endometrial"
-    if any(k in p for k in ["uterine","leiomyoma"]): return "Uterine"
-    if "bladder" in p: return "Bladder"
-    if any(k in p for k in ["kidney","renal","renal pelvis"]): return "Kidney"
-    if "thyroid" in p: return "Thyroid"
-    if any(k in p for k in ["esophageal","oesophageal","esophagus","oesophagus"]): return "Esophageal"
-    if any(k in p for k in ["testicular","germ cell"]): return "Testicular"
-    if any(k in p for k in ["liver","hepatic","intrahepatic bile duct","bile duct","gallbladder","cholangiocarcinoma"]): return "Hepatobiliary"
-    if any(k in p for k in ["brain","nervous system","glioma","glioblastoma"]): return "Brain/CNS"
-    if any(k in p for k in ["oropharynx","hypopharynx","larynx","pharynx","oral cavity","tongue","head and neck","salivary"]): return "Head & Neck"
-    if p.strip() in {"cancer"} or "cancer (" in p or "multiple cancers" in p or "hormone-sensitive cancer" in p:
-        return "Other/General"
-    return "Other/General"
-
-def load_pop_table(path: Path, pop: str) -> pd.DataFrame:
-    df = pd.read_csv(path, sep="\t", header=None, dtype=str, engine="python")
-    attrs = df.iloc[:, IDX["gtf_attrs"]].fillna("")
-    gene = attrs.str.extract(gene_pat, expand=False).fillna("").str.upper()
+def load_pop_table(path: Path, pop: str, genes: pd.DataFrame) -> pd.DataFrame:
+    df = read_closest_table(path, ["chr", "start", "end", "rsid", "phenotype", *GTF_FIELDS, "dist"])
+    gene = gene_names_for_gtf_columns(df[GTF_FIELDS], 0, genes).str.upper()
 
     out = pd.DataFrame({
-        "chr":   df.iloc[:, IDX["chr"]],
-        "start": df.iloc[:, IDX["start"]],
-        "end":   df.iloc[:, IDX["end"]],
-        "rsid":  df.iloc[:, IDX["rsid"]].fillna(""),
-        "phenotype": df.iloc[:, IDX["phenotype"]].fillna("").str.strip(),
+        "chr":   df["chr"],
+        "start": df["start"],
+        "end":   df["end"],
+        "rsid":  df["rsid"],
+        "phenotype": df["phenotype"].str.strip(),
         "gene":  gene,
+        "dist":  df["dist"],  # all NA if the table has no distance column
     })
 
-    # distance (numeric if present)
-    if IDX["dist"] < df.shape[1]:
-        out["dist"] = pd.to_numeric(df.iloc[:, IDX["dist"]], errors="coerce")
-    else:
-        out["dist"] = pd.NA
-
-    # stable variant key (prefer rsID)
-    out["var_key"] = out["rsid"].mask(out["rsid"].eq("") | out["rsid"].isna(),
-                                      out["chr"] + ":" + out["start"] + "-" + out["end"])
+    # stable variant key (prefer rsID), packed into an int64
+    out["var_key"] = variant_keys(out["chr"], out["start"], out["end"], out["rsid"])
     out["population"] = pop
     out["phenotype_norm"] = out["phenotype"].str.lower()
-    out["cancer_type"] = out["phenotype_norm"].apply(map_cancer_type)
+    out["cancer_type"] = map_cancer_types(out["phenotype_norm"])
     return out
 
 def unique_by_pheno(dfA, dfB, pop):
-    bmap = dfB.groupby("phenotype_norm")["var_key"].apply(set).to_dict()
-    parts = []
-    for ph, sub in dfA.groupby("phenotype_norm"):
-        others = bmap.get(ph, set())
-        parts.append(sub[~sub["var_key"].isin(others)])
-    out = pd.concat(parts, ignore_index=True) if parts else dfA.iloc[0:0].copy()
+    # anti-join on (phenotype_norm, var_key): keep dfA rows whose variant dfB does not have for the same phenotype
+    keys = ["phenotype_norm", "var_key"]
+    seen = dfA[keys].merge(dfB[keys].drop_duplicates(), on=keys, how="left", indicator=True)["_merge"].eq("both")
+    # grouped by phenotype (sorted), rows in their original order within each phenotype
+    out = dfA[~seen.to_numpy()].sort_values("phenotype_norm", kind="stable").reset_index(drop=True)
     out["population"] = pop
     return out
 
@@ -97,8 +58,9 @@ def main():
     OUTDIR.mkdir(parents=True, exist_ok=True)
 
     # 1) Load population tables
-    eur = load_pop_table(EUR_PATH, "EUR")
-    eas = load_pop_table(EAS_PATH, "EAS")
+    genes = load_gene_store(GENCODE_VERSION)
+    eur = load_pop_table(EUR_PATH, "EUR", genes)
+    eas = load_pop_table(EAS_PATH, "EAS", genes)
 
     # Copies for population-specific derivation (no CGC filtering here)
     eur_all = eur.copy()
@@ -161,7 +123,9 @@ def main():
     eur_both = eur_ps.merge(both_pairs_keys, on=["gene", "cancer_type"], how="inner")
     eas_both = eas_ps.merge(both_pairs_keys, on=["gene", "cancer_type"], how="inner")
 
-    # Long / tidy table (one row per variant)
+    # Long / tidy table (one row per variant), var_key written in its string form
+    eur_both["var_key"] = variant_labels(eur_both["chr"], eur_both["start"], eur_both["end"], eur_both["rsid"])
+    eas_both["var_key"] = variant_labels(eas_both["chr"], eas_both["start"], eas_both["end"], eas_both["rsid"])
     both_long = pd.concat([
         eur_both.assign(population="EUR")[["gene","cancer_type","population","rsid","chr","start","end","dist","var_key","variant_label"]],
         eas_both.assign(population="EAS")[["gene","cancer_type","population","rsid","chr","start","end","dist","var_key","variant_label"]],
@@ -0,0 +1,76 @@
+## Packed int64 variant keys, shared by CGC_associated_variants.py, unique_cancer_variants.py and af_diffs.py.
+## A key stands for exactly the variant the old string key did (the rsID, else "chr:start-end"), so dedups, isin and
+## merges on it keep the same rows, but hash one int64 per row instead of a Python string.
+
+import numpy as np
+import pandas as pd
+
+# The top two bits under the sign bit say how the other 61 are filled:
+#   RSID  - the number of an "rs<digits>" ID
+#   COORD - chromosome code (6 bits) | start (32 bits) | end - start (23 bits)
+#   HASH  - 61-bit hash of the string key, for anything that does not pack (odd IDs, contigs, missing coordinates)
+RSID_TAG, COORD_TAG, HASH_TAG = 0, 1, 2
+TAG_SHIFT, CHROM_SHIFT, START_SHIFT = 61, 55, 23
+PAYLOAD_MASK = (1 << TAG_SHIFT) - 1
+
+# "1" and "chr1" are different strings, so they get different codes
+CHROMS = [str(c) for c in range(1, 23)] + ["X", "Y", "M", "MT"]
+CHROM_CODES = {name: code for code, name in enumerate(CHROMS + ["chr" + c for c in CHROMS])}
+
+RSID_PATTERN = r"rs[1-9]\d{0,17}"                     # no leading zeros: "rs012" and "rs12" are different keys
+COORD_PATTERN = r"^([^:]+):(0|[1-9]\d*)-(0|[1-9]\d*)$"  # an ID written as "chr:start-end" is the same key as those coordinates
+
+def rsid_numbers(rsid: pd.Series) -> pd.Series:
+    """Numeric form of "rs<digits>" IDs (Int64); NA for empty or non-rs IDs."""
+    rsid = rsid.fillna("").astype(str)
+    is_rs = rsid.str.fullmatch(RSID_PATTERN).to_numpy(dtype=bool)
+    numbers = pd.Series(pd.NA, index=rsid.index, dtype="Int64")
+    numbers[is_rs] = rsid[is_rs].str.slice(2).astype(np.int64).to_numpy()
+    return numbers
+
+def chrom_codes(chrom: pd.Series) -> np.ndarray:
+    """CHROM_CODES code per row (float, NaN for other contigs), looked up once per distinct name."""
+    codes, names = pd.factorize(chrom.astype(str))
+    table = np.append(pd.Series(names).map(CHROM_CODES).to_numpy(dtype=np.float64), np.nan)
+    return table[codes]  # code -1 (missing) -> NaN
+
+def variant_labels(chrom: pd.Series, start: pd.Series, end: pd.Series, rsid: pd.Series) -> pd.Series:
+    """The string variant key: rsID if present, else chr:start-end."""
+    rsid = rsid.fillna("").astype(str)
+    return rsid.mask(rsid.eq(""), chrom.astype(str) + ":" + start.astype(str) + "-" + end.astype(str))
+
+def variant_keys(chrom: pd.Series, start: pd.Series, end: pd.Series, rsid: pd.Series) -> np.ndarray:
+    """Packed int64 key per row; equal exactly when variant_labels are equal (barring a 61-bit hash collision)."""
+    rsid = rsid.fillna("").astype(str).reset_index(drop=True)
+    chrom, start, end = (s.reset_index(drop=True) for s in (chrom, start, end))
+    rs = rsid_numbers(rsid)
+    is_rs = rs.notna().to_numpy()
+
+    # coordinates come from the columns, or from an rsID written as "chr:start-end"
+    code = chrom_codes(chrom)
+    pos = {name: pd.to_numeric(col, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+           for name, col in [("start", start), ("end", end)]}
+    from_cols = rsid.eq("").to_numpy()
+    maybe = np.flatnonzero(rsid.str.contains(":", regex=False).to_numpy(dtype=bool))
+    written = rsid.iloc[maybe].str.extract(COORD_PATTERN)
+    from_id = maybe[written[0].notna().to_numpy()]
+    written = written.dropna()
+    code[from_id] = chrom_codes(written[0])
+    pos["start"][from_id] = written[1].astype(np.float64).to_numpy()
+    pos["end"][from_id] = written[2].astype(np.float64).to_numpy()
+
+    span = pos["end"] - pos["start"]
+    packs = from_cols.copy()
+    packs[from_id] = True
+    packs &= ~np.isnan(code) & (pos["start"] >= 0) & (pos["start"] < 2**32) & (span >= 0) & (span < 2**START_SHIFT)
+
+    keys = np.zeros(len(rsid), dtype=np.int64)
+    keys[is_rs] = rs[is_rs].to_numpy(dtype=np.int64)
+    keys[packs] = ((COORD_TAG << TAG_SHIFT) | (code[packs].astype(np.int64) << CHROM_SHIFT)
+                   | (pos["start"][packs].astype(np.int64) << START_SHIFT) | span[packs].astype(np.int64))
+    rest = np.flatnonzero(~(is_rs | packs))
+    if len(rest):
+        labels = variant_labels(chrom.iloc[rest], start.iloc[rest], end.iloc[rest], rsid.iloc[rest])
+        hashed = pd.util.hash_array(labels.to_numpy(dtype=object)) & np.uint64(PAYLOAD_MASK)
+        keys[rest] = (HASH_TAG << TAG_SHIFT) | hashed.astype(np.int64)
+    return keys